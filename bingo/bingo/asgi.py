@@ -13,18 +13,25 @@ from channels.auth import AuthMiddlewareStack
 from channels.routing import ProtocolTypeRouter, URLRouter
 from django.core.asgi import get_asgi_application
 import bingoAPI.routing
+from bingoAPI.scheduler import SchedulerMiddleware, scheduler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bingo.settings')
 
 # Ensure Django apps are initialized
 django.setup()
 
-# Define the ASGI application
-application = ProtocolTypeRouter({
+from django.conf import settings
+from bingoAPI import game_loop
+
+if settings.BINGO_RECOVER_GAMES:
+    scheduler.on_attach(game_loop.recover_games)
+
+# Define the ASGI application; the game scheduler runs on the server's event loop
+application = SchedulerMiddleware(ProtocolTypeRouter({
     "http": get_asgi_application(),  # Handles HTTP requests
     "websocket": AuthMiddlewareStack(
         URLRouter(
             bingoAPI.routing.websocket_urlpatterns  # WebSocket routes
         )
     ),
-})
+}))
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -99,6 +101,16 @@ DATABASES = {
     }
 }
 
+# e.g. sqlite:///bench.sqlite3 to run the performance tests offline
+if os.getenv('DATABASE_URL'):
+    import dj_database_url
+    DATABASES['default'] = dj_database_url.parse(os.getenv('DATABASE_URL'))
+
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Take the write lock when a transaction begins and wait for it, rather
+    # than failing with "database is locked" under concurrent requests
+    DATABASES['default'].setdefault('OPTIONS', {}).update(transaction_mode='IMMEDIATE', timeout=20)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -151,6 +163,96 @@ REST_FRAMEWORK = {
     )
 }
 
+# Channel layer used to broadcast to the players of each game.
+# The in-memory layer only reaches sockets of the current process; set REDIS_URL
+# (requires channels-redis) to run several Daphne workers behind a balancer.
+if os.getenv('REDIS_URL'):
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [os.getenv('REDIS_URL')],
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
+# Cache shared by the workers; the token cache relies on it to forget tokens
+# on logout, so use Redis when running several workers.
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        },
+    }
+
+# How long the WebSocket handshake may trust a cached token -> user lookup
+BINGO_TOKEN_CACHE_SECONDS = int(os.getenv('BINGO_TOKEN_CACHE_SECONDS') or '300')
+
+# How long a served bingo card stays cached; entries are dropped with the player
+BINGO_CARD_CACHE_SECONDS = int(os.getenv('BINGO_CARD_CACHE_SECONDS') or '3600')
+
+# Settle a game as soon as a drawn ball completes a card, without waiting
+# for the player to claim it.
+BINGO_AUTO_WIN = os.getenv('BINGO_AUTO_WIN', default='False') == 'True'
+
+# Drawn balls are kept in memory by the game loop and written to the Game row
+# every BINGO_FLUSH_EVERY balls. Keep it at 1 when claims may be served by
+# another worker than the one drawing the game.
+BINGO_FLUSH_EVERY = int(os.getenv('BINGO_FLUSH_EVERY') or '1')
+
+# Resume the timers of unfinished games when the server starts. Set it to
+# True on a single worker only, or games would be drawn twice.
+BINGO_RECOVER_GAMES = os.getenv('BINGO_RECOVER_GAMES', default='False') == 'True'
+
+# Unissued cards each process keeps ready for registration
+BINGO_CARD_POOL_SIZE = int(os.getenv('BINGO_CARD_POOL_SIZE') or '500')
+
+# Cards a pool held for longer go back to the shared pool, e.g. after a restart
+BINGO_CARD_RESERVATION_SECONDS = int(os.getenv('BINGO_CARD_RESERVATION_SECONDS') or '86400')
+
+# Most cards a player may buy when registering for a game
+BINGO_MAX_CARDS = int(os.getenv('BINGO_MAX_CARDS') or '24')
+
+# Addresses allowed to scrape /api/metrics, comma separated. Behind a proxy
+# this is the proxy's address, so serve the metrics on an internal port there.
+BINGO_METRICS_IPS = (os.getenv('BINGO_METRICS_IPS') or '127.0.0.1,::1').split(',')
+
+# Timings of each game mode, in seconds. Players may pick a mode when they
+# register; they get BINGO_GAME_MODE otherwise.
+BINGO_GAME_MODES = {
+    'classic': {'lobby_timeout': 60, 'countdown': 30, 'ball_interval': 5},
+    'turbo': {'lobby_timeout': 20, 'countdown': 5, 'ball_interval': 1},
+}
+BINGO_GAME_MODE = os.getenv('BINGO_GAME_MODE') or 'classic'
+if BINGO_GAME_MODE not in BINGO_GAME_MODES:
+    raise ImproperlyConfigured(f"BINGO_GAME_MODE must be one of {', '.join(BINGO_GAME_MODES)}")
+
+# Game loop and WebSocket logs; DEBUG logs every ball and broadcast
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'bingoAPI': {
+            'handlers': ['console'],
+            'level': os.getenv('BINGO_LOG_LEVEL') or 'INFO',
+            # Daphne's root handler would print each line a second time
+            'propagate': False,
+        },
+    },
+}
+
 CORS_ALLOWED_ORIGINS = [
     'http://localhost:5173'
 ]
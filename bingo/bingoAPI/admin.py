@@ -4,5 +4,6 @@ from .models import *
 admin.site.register(Game)
 admin.site.register(Player)
 admin.site.register(BingoCard)
+admin.site.register(DrawnBall)
 
 # Register your models here.
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class BingoapiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bingoAPI'
+
+    def ready(self):
+        from . import auth  # noqa: F401 (connects the token cache invalidation)
+        from . import card_cache  # noqa: F401 (connects the card cache invalidation)
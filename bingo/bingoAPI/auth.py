@@ -0,0 +1,49 @@
+"""
+Token -> user lookups cached for the WebSocket handshake, so a wave of
+players reconnecting doesn't mean a wave of token queries.
+
+Only the user's id and username are cached, never the password hash; the
+other fields load on first access. Entries are dropped when the token is
+deleted and whenever the user is saved, e.g. deactivated.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+
+def token_cache_key(key):
+    return f"bingo:token:{key}"
+
+
+def get_token_user(key):
+    """Return the active user owning the token, or ``None``."""
+    cache_key = token_cache_key(key)
+    cached = cache.get(cache_key)
+    if cached is None:
+        token = Token.objects.select_related('user').filter(key=key).first()
+        if token is None or not token.user.is_active:
+            return None
+        cache.set(cache_key, (token.user.id, token.user.username), settings.BINGO_TOKEN_CACHE_SECONDS)
+        return token.user
+    return User.from_db(DEFAULT_DB_ALIAS, ['id', 'username', 'is_active'], [*cached, True])
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    # djoser's token/logout deletes the user's tokens
+    cache.delete(token_cache_key(instance.key))
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, update_fields=None, **kwargs):
+    # Logins only touch last_login, which isn't cached
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    keys = [token_cache_key(key) for key in Token.objects.filter(user=instance).values_list('key', flat=True)]
+    if keys:
+        # After commit, or a lookup in between would cache the old state again
+        transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,59 @@
+"""
+Serialized bingo cards cached per player, so the card clients poll after
+every reconnect is served without queries, or as a 304 when they have it.
+Cards never change once issued; entries only go when the player row does.
+"""
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Subquery
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cards import COLUMNS
+from .models import BingoCard, Player
+
+
+def card_cache_key(user_id, game_id=None):
+    # Without a game: the cards of the user's latest game
+    return f"bingo:card:{user_id}:{'latest' if game_id is None else game_id}"
+
+
+async def get_player_card(user, game_id=None):
+    """Return ``(etag, body)`` of the user's cards in game ``game_id``, or ``None``."""
+    key = card_cache_key(user.id, game_id)
+    cached = await cache.aget(key)
+    if cached is None:
+        players = Player.objects.filter(user=user)
+        if game_id is not None:
+            players = players.filter(game_id=game_id)
+        # One query for the player and all of their cards
+        player = Subquery(players.order_by('-id').values('id')[:1])
+        rows = [
+            row async for row in
+            BingoCard.objects.filter(player=player).order_by('id').values_list('player_id', 'numbers')
+        ]
+        if not rows:
+            return None
+        cards = [{column: numbers[column] for column in COLUMNS} for _, numbers in rows]
+        # The first card is also sent on its own for clients playing one card
+        body = json.dumps({"card": cards[0], "cards": cards})
+        cached = (f'"player-{rows[0][0]}"', body)
+        await cache.aset(key, cached, settings.BINGO_CARD_CACHE_SECONDS)
+    return cached
+
+
+@receiver(post_save, sender=Player)
+def invalidate_latest_card(sender, instance, created, **kwargs):
+    if created:
+        # After commit: a poll in between would cache the previous game's cards
+        key = card_cache_key(instance.user_id)
+        transaction.on_commit(lambda: cache.delete(key))
+
+
+@receiver(post_delete, sender=Player)
+def invalidate_card(sender, instance, **kwargs):
+    # Disqualified players, and players of deleted games
+    cache.delete_many([card_cache_key(instance.user_id), card_cache_key(instance.user_id, instance.game_id)])
@@ -0,0 +1,147 @@
+"""
+Compact bingo card representation: the 25 cells are bits of an int, laid out
+row by row, so marking a ball is a dict lookup plus an OR and a win check is
+a few AND/compare operations against constant patterns.
+"""
+import hashlib
+import random
+
+COLUMNS = ['B', 'I', 'N', 'G', 'O']
+SIZE = 5
+COLUMN_RANGES = {
+    'B': range(1, 16),
+    'I': range(16, 31),
+    'N': range(31, 46),
+    'G': range(46, 61),
+    'O': range(61, 76),
+}
+
+# Label of each ball, e.g. BALL_LABELS[22] == 'I22'; index 0 is unused
+BALL_LABELS = ('',) + tuple(f"{key}{ball}" for key in COLUMNS for ball in COLUMN_RANGES[key])
+
+
+def generate_card_numbers(rng=random):
+    card = {key: rng.sample(COLUMN_RANGES[key], SIZE) for key in COLUMNS}
+    card['N'][2] = None
+    return card
+
+
+def card_fingerprint(numbers):
+    """
+    Signed 64-bit digest of the 24 numbers in card order, used as the unique
+    key of a card. Two different cards sharing a digest only cost a retry.
+    """
+    data = bytes(num for key in COLUMNS for num in numbers[key] if num is not None)
+    digest = hashlib.blake2b(data, digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def cell_bit(column, row):
+    return 1 << (row * SIZE + column)
+
+
+ROW_PATTERNS = [sum(cell_bit(col, row) for col in range(SIZE)) for row in range(SIZE)]
+COLUMN_PATTERNS = [sum(cell_bit(col, row) for row in range(SIZE)) for col in range(SIZE)]
+DIAGONAL_PATTERNS = [
+    sum(cell_bit(i, i) for i in range(SIZE)),
+    sum(cell_bit(SIZE - 1 - i, i) for i in range(SIZE)),
+]
+LINE_PATTERNS = ROW_PATTERNS + COLUMN_PATTERNS + DIAGONAL_PATTERNS
+FOUR_CORNERS = cell_bit(0, 0) | cell_bit(SIZE - 1, 0) | cell_bit(0, SIZE - 1) | cell_bit(SIZE - 1, SIZE - 1)
+FULL_CARD = (1 << SIZE * SIZE) - 1
+
+# A full card always contains a complete row, so it needs no pattern of its own.
+WIN_PATTERNS = tuple(LINE_PATTERNS + [FOUR_CORNERS])
+
+
+def is_winning_mask(marks):
+    for pattern in WIN_PATTERNS:
+        if marks & pattern == pattern:
+            return True
+    return False
+
+
+class CardMask:
+    """
+    Marks of one card. ``cells`` maps every number on the card to its cell bit;
+    free spaces (``None``) start out marked.
+    """
+    __slots__ = ('cells', 'marks')
+
+    def __init__(self, numbers):
+        self.cells = {}
+        self.marks = 0
+        for col, key in enumerate(COLUMNS):
+            for row, num in enumerate(numbers[key]):
+                if num is None:
+                    self.marks |= cell_bit(col, row)
+                else:
+                    self.cells[num] = cell_bit(col, row)
+
+    def mark(self, ball):
+        """Mark ``ball`` if it's on the card; returns whether it was."""
+        bit = self.cells.get(ball)
+        if bit is None:
+            return False
+        self.marks |= bit
+        return True
+
+    def mark_all(self, balls):
+        for ball in balls:
+            self.mark(ball)
+        return self
+
+    def mark_drawn(self, drawn):
+        """Mark the card's numbers found in the set ``drawn``; cheaper than mark_all for many balls."""
+        for ball, bit in self.cells.items():
+            if ball in drawn:
+                self.marks |= bit
+        return self
+
+    def is_winner(self):
+        return is_winning_mask(self.marks)
+
+
+class WinTracker:
+    """
+    Card masks of every card in a game with a ball -> cards inverted index,
+    so each drawn ball only marks and checks the cards that carry it.
+    """
+
+    def __init__(self):
+        self.cards = {}
+        self.index = {}
+        self.winners = {}  # insertion-ordered set of winning keys
+
+    def add(self, key, numbers, drawn_balls=()):
+        mask = CardMask(numbers).mark_all(drawn_balls)
+        self.cards[key] = mask
+        for ball in mask.cells:
+            self.index.setdefault(ball, []).append(key)
+        if mask.is_winner():
+            self.winners[key] = None
+
+    def remove(self, key):
+        mask = self.cards.pop(key, None)
+        if mask is None:
+            return
+        for ball in mask.cells:
+            self.index[ball].remove(key)
+        self.winners.pop(key, None)
+
+    def mark(self, ball):
+        """Mark ``ball`` on every card carrying it; returns the keys that just won."""
+        new_winners = []
+        for key in self.index.get(ball, ()):
+            mask = self.cards[key]
+            mask.mark(ball)
+            if key not in self.winners and mask.is_winner():
+                self.winners[key] = None
+                new_winners.append(key)
+        return new_winners
+
+    def __contains__(self, key):
+        return key in self.cards
+
+    def is_winner(self, key):
+        return key in self.winners
@@ -0,0 +1,24 @@
+"""
+Clocks driving the GameScheduler. Real games run on the monotonic wall clock;
+tests and simulations use a VirtualClock, so minutes of countdowns and draws
+pass in milliseconds.
+"""
+import time
+
+monotonic = time.monotonic
+
+
+class VirtualClock:
+    """Monotonic clock that only moves when told to."""
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    def advance_to(self, when):
+        self.now = max(self.now, when)
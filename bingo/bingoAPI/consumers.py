@@ -1,110 +1,216 @@
 import json
+import logging
+import time
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+
+from . import metrics, wire
+
+logger = logging.getLogger(__name__)
+
+# Balls in a game, hence the highest sequence number
+MAX_SEQ = 75
+
+
+def game_group_name(game_id):
+    return f"game_{game_id}"
+
 
 class GameConsumer(AsyncWebsocketConsumer):
-    connected_clients = set()  # Maintain a set of connected WebSocket clients
+    user = None
+    game_group = None
+    wire_format = wire.JSON
 
     async def connect(self):
         try:
-            await self.accept()
-            print("\n\nWebSocket connection accepted\n\n")
+            # Clients pick a compact wire format with a subprotocol
+            self.wire_format = wire.pick_format(self.scope.get('subprotocols', ()))
+            await self.accept(None if self.wire_format == wire.JSON else self.wire_format)
+            metrics.ws_connections.inc()
+            logger.debug("WebSocket connection accepted")
             # Wait for the token after the connection is established
             # The token validation logic will be inside the `receive` method
 
-        except Exception as e:
-            print(f"\n\nException during connect: {e}\n\n")
+        except Exception:
+            logger.exception("Exception during connect")
             await self.close()
 
     async def receive(self, text_data):
         """
-        Handles receiving a message over WebSocket and token validation.
+        Handles receiving a message over WebSocket. The first message must
+        carry the token; later ones skip authentication.
         """
         try:
             # Decode the received data
             text_data_json = json.loads(text_data)
-            token = text_data_json.get('token')
-
-            # Token validation
-            if not token:
-                print("Token not found in the received data.")
-                await self.close(code=4004)
-                return
 
-            # Authenticate user with the token
-            self.user = await self.authenticate_user(token)
-            if not self.user:
-                print("\n\nUser authentication failed\n\n")
-                await self.close(code=4003)
-            # Fetch active game
-            self.game = await self.get_active_game()
-            if not self.game:
-                print("\n\nNo active game found\n\n")
-                await self.close()
+            if self.user is None and not await self.handshake(text_data_json):
                 return
 
-            self.connected_clients.add(self)
-            await self.send_to_all({
-                'type': 'game.total_players',
-                'message': {'total_players': len(self.connected_clients)}
-            })
-
             message = text_data_json.get('message')
             if message:
-                print(f"Received message: {message}")
+                logger.debug("Received message: %s", message)
 
         except json.JSONDecodeError as e:
-            print(f"Error decoding JSON: {e}")
+            logger.info("Error decoding JSON: %s", e)
             await self.close(code=4004)
 
-        except Exception as e:
-            print(f"Error processing received message: {e}")
+        except Exception:
+            logger.exception("Error processing received message")
             await self.close(code=4005)
 
+    async def handshake(self, text_data_json):
+        """
+        Authenticate the socket and join its game's room. Returns whether the
+        socket is still open.
+        """
+        token = text_data_json.get('token')
+
+        # Token validation
+        if not token:
+            logger.info("Token not found in the received data.")
+            await self.close(code=4004)
+            return False
+
+        # Authenticate user with the token and fetch the game this socket is
+        # for; the user must be one of its players
+        user, game = await self.authenticate(token, self.scope['url_route']['kwargs'].get('game_id'))
+        if not user:
+            logger.info("User authentication failed")
+            await self.close(code=4003)
+            return False
+        if not game:
+            logger.info("No active game found for %s", user.username)
+            await self.close()
+            return False
+        self.user, self.game = user, game
+
+        # Join the game's room so broadcasts reach this socket from any worker
+        self.game_group = game_group_name(self.game.id)
+        await self.channel_layer.group_add(self.game_group, self.channel_name)
+        await self.send_to_game(self.game.id, {
+            'type': 'game.total_players',
+            'message': {'total_players': await self.count_players()}
+        })
+
+        # A reconnecting client tells which ball it saw last; anything but a
+        # sequence number of a game is ignored
+        try:
+            last_seq = int(text_data_json['last_seq'])
+        except (KeyError, TypeError, ValueError):
+            return True
+        if 0 <= last_seq <= MAX_SEQ:
+            await self.send_missed_balls(last_seq)
+        return True
 
     async def disconnect(self, close_code):
-        self.connected_clients.discard(self)
-        print(f"\n\nWebSocket disconnected with close code: {close_code}\n\n")
+        metrics.ws_connections.dec()
+        if self.game_group:
+            await self.channel_layer.group_discard(self.game_group, self.channel_name)
+        logger.debug("WebSocket disconnected with close code: %s", close_code)
+
+    async def broadcast_message(self, event):
+        """
+        Relay a group broadcast; the payload was serialized once per wire
+        format by the sender.
+        """
+        started = time.perf_counter()
+        try:
+            await self.send_frame(event['frames'][self.wire_format])
+        except Exception:
+            metrics.ws_send_failures.inc()
+            logger.debug("Could not send to %s", self.channel_name, exc_info=True)
+            return
+        metrics.ws_send_seconds.observe(time.perf_counter() - started)
+        if 'drawn_at' in event:
+            metrics.ball_delivery_seconds.observe(time.time() - event['drawn_at'])
+
+    async def broadcast_disconnect(self, event):
+        await self.close()
 
     @classmethod
-    async def disconnect_all(cls):
+    async def disconnect_game(cls, game_id):
         """
-        Disconnect all currently connected WebSocket clients.
+        Disconnect every WebSocket client connected to the game.
         """
-        print(f"\n\nDisconnecting all {len(cls.connected_clients)} clients.\n\n")
-        for client in list(cls.connected_clients):  # Create a list copy to avoid modification during iteration
-            try:
-                await client.close()
-            except Exception as e:
-                print(f"Error disconnecting client: {e}")
-        cls.connected_clients.clear()
+        logger.info("Disconnecting all clients of game %s", game_id)
+        await get_channel_layer().group_send(game_group_name(game_id), {'type': 'broadcast.disconnect'})
 
     @classmethod
-    async def send_to_all(cls, message):
+    async def send_to_game(cls, game_id, message):
         """
-        Broadcast a message to all connected WebSocket clients.
+        Broadcast a message to every WebSocket client connected to the game.
+
+        The channel layer queues the payload for each recipient, so a slow
+        client only delays its own socket.
         """
-        print(f"Broadcasting message to {len(cls.connected_clients)} clients: {message}")
-        for client in cls.connected_clients:
-            try:
-                await client.send(text_data=json.dumps(message))
-            except Exception as e:
-                print(f"Error sending message to client: {e}")
+        logger.debug("Broadcasting message to game %s: %s", game_id, message)
+        await cls.broadcast_frames(game_id, message['type'], wire.encode_message(message))
 
-    @database_sync_to_async
-    def authenticate_user(self, token):
-        from rest_framework.authtoken.models import Token
-        try:
-            return Token.objects.get(key=token).user
-        except Token.DoesNotExist:
-            print("\n\nInvalid token\n\n")
-            return None
+    @classmethod
+    async def send_ball(cls, game_id, seq, number, drawn_at=None):
+        """
+        Broadcast a drawn ball. ``drawn_at`` (a ``time.time()`` timestamp)
+        lets each socket measure how long the ball took to reach it.
+        """
+        await cls.broadcast_frames(game_id, 'game.ball', wire.encode_ball(seq, number), drawn_at)
+
+    @classmethod
+    async def broadcast_frames(cls, game_id, message_type, frames, drawn_at=None):
+        metrics.broadcasts.inc(type=message_type)
+        event = {'type': 'broadcast.message', 'frames': frames}
+        if drawn_at is not None:
+            event['drawn_at'] = drawn_at
+        await get_channel_layer().group_send(game_group_name(game_id), event)
+
+    async def send_frame(self, frame):
+        if isinstance(frame, bytes):
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
+
+    async def send_missed_balls(self, last_seq):
+        """
+        Replay the balls drawn after ``last_seq`` in one message. The socket
+        already joined the game's room, so a ball drawn meanwhile may arrive
+        twice; clients drop it by ``seq``.
+        """
+        from .game_loop import games
+
+        state = games.get(self.game.id)
+        if state is not None:
+            balls = state.drawn_balls[last_seq:]
+        else:
+            # The game is drawn by another worker
+            balls = await database_sync_to_async(self.game.get_drawn_balls)(last_seq)
+
+        await self.send_frame(wire.encode_catch_up(last_seq + 1, balls)[self.wire_format])
 
     @database_sync_to_async
-    def get_active_game(self):
+    def authenticate(self, token, game_id=None):
+        """
+        Return ``(user, game)`` for the token: the game ``game_id`` if the user
+        plays in it, or the user's current game when no id was given.
+        """
+        from .auth import get_token_user
         from .models import Game
-        try:
-            return Game.objects.get(is_active=False, winner=None)
-        except Game.DoesNotExist:
-            print("\n\nNo active game found\n\n")
-            return None
+
+        user = get_token_user(token)
+        if user is None:
+            logger.info("Invalid token")
+            return None, None
+
+        games = Game.objects.filter(winner=None, player__user=user)
+        if game_id is not None:
+            return user, games.filter(pk=game_id).first()
+        return user, games.order_by('-id').first()
+
+    async def count_players(self):
+        from .game_loop import games
+        from .models import Game
+
+        state = games.get(self.game.id)
+        if state is not None:
+            return len(state.players)
+        return await Game.objects.filter(pk=self.game.id).values_list('player_count', flat=True).afirst() or 0
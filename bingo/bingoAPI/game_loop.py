@@ -0,0 +1,237 @@
+"""
+Countdown, ball drawing and lobby timeout for every game, driven by the shared
+GameScheduler instead of one sleeping thread per game.
+"""
+import logging
+import time
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from . import metrics
+from .cards import BALL_LABELS
+from .consumers import GameConsumer
+from .game_state import GameState
+from .models import Game, Player
+from .scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+# State of the games drawn by this process, keyed by game id
+games = {}
+
+# Retries of a ball that couldn't be saved, the first after FLUSH_RETRY_DELAY
+# seconds and doubling; the game is ended once they're used up
+FLUSH_RETRIES = 5
+FLUSH_RETRY_DELAY = 1
+
+
+def _channel_queue_depth():
+    # Only the in-memory layer keeps its queues in this process
+    queues = getattr(get_channel_layer(), 'channels', None)
+    return sum(queue.qsize() for queue in list(queues.values())) if queues else 0
+
+
+metrics.Gauge('bingo_games_drawn', "Games drawn by this process.", function=lambda: len(games))
+metrics.Gauge('bingo_scheduled_timers', "Pending game timers.", function=lambda: len(scheduler))
+metrics.Gauge('bingo_channel_queue_depth', "Messages waiting in the in-memory channel layer.",
+              function=_channel_queue_depth)
+
+
+def game_timings(mode):
+    """Lobby timeout, countdown and ball interval of a game mode, in seconds."""
+    return settings.BINGO_GAME_MODES[mode]
+
+
+def schedule_lobby_timeout(game_id, mode):
+    scheduler.schedule(('timeout', game_id), game_timings(mode)['lobby_timeout'], check_timeout, game_id)
+
+
+def schedule_countdown(game_id, mode):
+    scheduler.schedule(('countdown', game_id), game_timings(mode)['countdown'], start_countdown, game_id)
+
+
+def schedule_next_ball(game_id, mode):
+    scheduler.schedule(('ball', game_id), game_timings(mode)['ball_interval'], draw_next_ball, game_id)
+
+
+def stop_game(game_id):
+    """Cancel every pending timer of the game and forget its state."""
+    for kind in ('timeout', 'countdown', 'ball'):
+        scheduler.cancel((kind, game_id))
+    games.pop(game_id, None)
+
+
+@database_sync_to_async
+def _cancel_if_underpopulated(game_id):
+    with transaction.atomic():
+        # Locked like registrations lock their lobby, so nobody joins it
+        # between the check and the delete
+        game = (
+            Game.objects.select_for_update()
+            .filter(pk=game_id, is_active=False, winner=None, player_count__lt=2)
+            .first()
+        )
+        if game is None:
+            return
+        # Notify the single player (if any)
+        player = Player.objects.filter(game=game).select_related('user').first()
+        if player:
+            logger.info("Notifying user %s: Game canceled due to insufficient players.", player.user.username)
+        game.delete()
+
+
+async def check_timeout(game_id):
+    """Deletes the game if it doesn't reach 2 players within the lobby timeout."""
+    await _cancel_if_underpopulated(game_id)
+
+
+def tracked_winner(game_id, user_id):
+    """
+    Whether one of the user's cards has won, from the in-memory game state.
+    Returns ``None`` when the game isn't drawn by this process.
+    """
+    state = games.get(game_id)
+    if state is None:
+        return None
+    return state.is_winner(user_id)
+
+
+def remove_player(game_id, user_id):
+    state = games.get(game_id)
+    if state is not None:
+        state.remove_player(user_id)
+
+
+@database_sync_to_async
+def _start_game(game_id):
+    game = Game.objects.filter(pk=game_id).first()
+    if game is None or not game.start():
+        return None
+    state = games[game.id] = GameState.load(game)
+    return state
+
+
+async def start_countdown(game_id):
+    state = await _start_game(game_id)
+    if state is not None:
+        scheduler.cancel(('timeout', game_id))
+        schedule_next_ball(game_id, state.mode)
+
+
+@database_sync_to_async
+def _load_state(game_id):
+    game = Game.objects.filter(pk=game_id, is_active=True).first()
+    return GameState.load(game) if game else None
+
+
+@database_sync_to_async
+def _end_game(state):
+    """Delete a game that ended without a winner."""
+    Game.objects.filter(pk=state.game_id, winner=None).delete()
+
+
+async def draw_next_ball(game_id):
+    """Draw one ball, notify the WebSocket clients and schedule the next draw."""
+    state = games.get(game_id)
+    if state is None:
+        state = games[game_id] = await _load_state(game_id)
+        if state is None:
+            logger.warning("Game %s no longer exists. Stopping ball drawing.", game_id)
+            await finish_game(game_id)
+            return
+
+    drawn_at = time.time()
+    new_ball, winners = state.draw_ball()
+    if new_ball is None:
+        logger.info("No new ball. Ending game %s.", game_id)
+        await _end_game(state)
+        await finish_game(game_id)
+        return
+
+    if winners and settings.BINGO_AUTO_WIN:
+        # Settle the game right away; the earliest registered winner takes it
+        state.finish(winners[0])
+
+    await commit_ball(game_id, new_ball, drawn_at)
+
+
+async def commit_ball(game_id, new_ball, drawn_at, attempt=0):
+    """Save a drawn ball, then broadcast it and schedule the next draw."""
+    state = games.get(game_id)
+    if state is None:
+        # Stopped while a retry was pending
+        return
+
+    pending = len(state.pending)
+    try:
+        flushed = await database_sync_to_async(state.flush)()
+    except IntegrityError:
+        # Another worker draws the game too; don't answer claims from balls
+        # that weren't saved
+        games.pop(game_id, None)
+        raise
+    except Exception:
+        if attempt >= FLUSH_RETRIES:
+            logger.exception("Could not save ball %s of game %s. Ending the game.", BALL_LABELS[new_ball], game_id)
+            try:
+                # Releases the players, who could never finish it
+                await _end_game(state)
+            finally:
+                await finish_game(game_id)
+            return
+        delay = FLUSH_RETRY_DELAY * 2 ** attempt
+        logger.exception("Could not save ball %s of game %s. Retrying in %ss.", BALL_LABELS[new_ball], game_id, delay)
+        scheduler.schedule(('ball', game_id), delay, commit_ball, game_id, new_ball, drawn_at, attempt + 1)
+        return
+    metrics.balls_drawn.inc()
+    if len(state.pending) < pending:
+        # Only draws that were written; the others wait for a later flush
+        metrics.draw_commit_seconds.observe(time.time() - drawn_at)
+    if not flushed:
+        # Settled or deleted by a claim handled elsewhere
+        stop_game(game_id)
+        return
+
+    logger.debug("Generated ball %s for game %s", BALL_LABELS[new_ball], game_id)
+    if state.is_active:
+        schedule_next_ball(game_id, state.mode)
+    await GameConsumer.send_ball(game_id, state.seq, new_ball, drawn_at=drawn_at)
+    metrics.draw_broadcast_seconds.observe(time.time() - drawn_at)
+
+    if not state.is_active:
+        await GameConsumer.send_to_game(game_id, {
+            'type': 'game.finish',
+            'message': {'state': 'finished'}
+        })
+        await finish_game(game_id)
+
+
+async def finish_game(game_id):
+    stop_game(game_id)
+    await GameConsumer.disconnect_game(game_id)
+
+
+@database_sync_to_async
+def _unfinished_games():
+    return [
+        (game, game.is_active and GameState.load(game))
+        for game in Game.objects.filter(winner=None)
+    ]
+
+
+async def recover_games():
+    """
+    Rebuild the in-memory state of unfinished games from the database and
+    resume their timers, e.g. after a restart.
+    """
+    for game, state in await _unfinished_games():
+        if state:
+            games[game.id] = state
+            schedule_next_ball(game.id, game.mode)
+        elif game.can_start():
+            schedule_countdown(game.id, game.mode)
+        else:
+            schedule_lobby_timeout(game.id, game.mode)
@@ -0,0 +1,135 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists
+from django.utils import timezone
+
+from .cards import WinTracker
+from .draws import continue_order, draw_order
+from .models import BingoCard, DrawnBall, Game, Player
+
+
+class GameState:
+    """
+    Authoritative state of a running game, owned by the game loop.
+
+    Balls are drawn in memory and written behind every ``BINGO_FLUSH_EVERY``
+    balls: the new DrawnBall rows in one INSERT, plus a one-column UPDATE of
+    the Game row that also tells whether the game is still running.
+    """
+
+    def __init__(self, game_id, drawn_balls=(), is_active=True, winner_id=None, mode=Game.DEFAULT_MODE,
+                 order=None):
+        self.game_id = game_id
+        self.mode = mode
+        self.drawn_balls = list(drawn_balls)
+        # Every ball of the game in draw order; drawn_balls is its prefix
+        self.order = order or continue_order(self.drawn_balls)
+        self.is_active = is_active
+        self.winner_id = winner_id
+        # Cards are tracked by card id
+        self.tracker = WinTracker()
+        self.owners = {}
+        self.player_cards = {}
+        self.pending = []
+
+    @classmethod
+    def load(cls, game):
+        """Rebuild the state of ``game`` from the database, e.g. after a restart."""
+        order = draw_order(game.draw_seed) if game.draw_seed else None
+        state = cls(game.id, game.get_drawn_balls(), game.is_active, game.winner_id, game.mode, order)
+        cards = (
+            BingoCard.objects.filter(player__game=game)
+            .order_by('player_id', 'id')
+            .values_list('player__user_id', 'id', 'numbers')
+        )
+        for user_id, card_id, numbers in cards:
+            state.add_player(user_id, [(card_id, numbers)])
+        return state
+
+    @property
+    def seq(self):
+        """Sequence number of the last drawn ball."""
+        return len(self.drawn_balls)
+
+    @property
+    def players(self):
+        return self.player_cards.keys()
+
+    def add_player(self, user_id, cards):
+        """Track the user's ``cards``, given as ``(card_id, numbers)`` pairs."""
+        card_ids = self.player_cards.setdefault(user_id, [])
+        for card_id, numbers in cards:
+            self.tracker.add(card_id, numbers, self.drawn_balls)
+            self.owners[card_id] = user_id
+            card_ids.append(card_id)
+
+    def remove_player(self, user_id):
+        for card_id in self.player_cards.pop(user_id, ()):
+            self.tracker.remove(card_id)
+            del self.owners[card_id]
+
+    def is_winner(self, user_id):
+        """Whether one of the user's cards has won; ``None`` if they don't play this game."""
+        card_ids = self.player_cards.get(user_id)
+        if card_ids is None:
+            return None
+        return any(self.tracker.is_winner(card_id) for card_id in card_ids)
+
+    def draw_ball(self):
+        """
+        Draw the next ball and mark it on every card carrying it. Returns
+        ``(ball, new_winners)``, the users with a card that just won, each
+        listed once; ``ball`` is ``None`` once all 75 are out.
+        """
+        if self.seq >= len(self.order):
+            return None, []
+        new_ball = self.order[self.seq]
+        self.drawn_balls.append(new_ball)
+        self.pending.append(DrawnBall(
+            game_id=self.game_id, seq=self.seq, number=new_ball, drawn_at=timezone.now()
+        ))
+        winning_cards = self.tracker.mark(new_ball)
+        return new_ball, list(dict.fromkeys(self.owners[card_id] for card_id in winning_cards))
+
+    def finish(self, winner_id=None):
+        self.is_active = False
+        self.winner_id = winner_id
+
+    def flush(self, force=False):
+        """
+        Write the pending balls (and the result, once finished) to the database.
+
+        Returns ``False`` when the Game row is gone or no longer active, i.e.
+        the game was settled or deleted by another request or process.
+        """
+        batch = 1 if force else settings.BINGO_FLUSH_EVERY
+        if self.is_active and len(self.pending) < batch:
+            return True
+
+        while True:
+            games = Game.objects.filter(pk=self.game_id, is_active=True)
+            fields = {'drawn_count': self.seq}
+            if not self.is_active:
+                fields.update(is_active=False, winner_id=self.winner_id, drawn_balls=self.drawn_balls)
+                if self.winner_id is not None:
+                    # A claim handled by another worker may have disqualified them
+                    games = games.filter(Exists(Player.objects.filter(game_id=self.game_id, user_id=self.winner_id)))
+            with transaction.atomic(savepoint=False):
+                updated = games.update(**fields)
+                if updated:
+                    DrawnBall.objects.bulk_create(self.pending)
+            if updated or self.is_active or self.winner_id is None:
+                break
+            self.pass_win()
+        self.pending = []
+        return updated == 1
+
+    def pass_win(self):
+        """
+        Drop a winner who is no longer a player; the win goes to the next
+        player with a complete card, or the game goes on.
+        """
+        self.remove_player(self.winner_id)
+        self.winner_id = next((user_id for user_id in self.players if self.is_winner(user_id)), None)
+        if self.winner_id is None:
+            self.is_active = True
@@ -0,0 +1,187 @@
+"""
+Load generator: simulated players sign up and log in through djoser,
+register to a game, follow it over the WebSocket and claim as soon as one of
+their cards wins, like the real clients do.
+
+Run it against a server started with ``daphne bingo.asgi:application``; it
+needs the ``websockets`` package.
+"""
+import asyncio
+import json
+import math
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bingoAPI import wire
+from bingoAPI.cards import CardMask
+
+
+def received_balls(frame):
+    """``(seq, ball)`` pairs carried by a WebSocket frame of any wire format."""
+    if isinstance(frame, bytes):
+        kind, seq, *balls = frame
+        return list(enumerate(balls, start=seq))
+    message = json.loads(frame)
+    if isinstance(message, list):
+        if message[0] == 'b':
+            return [(message[1], message[2])]
+        if message[0] == 'c':
+            return list(enumerate(message[2], start=message[1]))
+        return []
+    if message['type'] == 'game.ball':
+        balls = [message['message']]
+    elif message['type'] == 'game.catch_up':
+        balls = message['message']['balls']
+    else:
+        return []
+    return [(ball['seq'], int(ball['ball'][1:])) for ball in balls]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list."""
+    return values[max(math.ceil(pct / 100 * len(values)) - 1, 0)]
+
+
+class LoadStats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.counts = defaultdict(int)
+        # (game id, seq) -> when the first player received the ball
+        self.first_receipt = {}
+
+    def record(self, operation, seconds):
+        self.latencies[operation].append(seconds)
+
+    def ball_received(self, game_id, seq, at):
+        first = self.first_receipt.setdefault((game_id, seq), at)
+        self.record('fan-out', at - first)
+        self.counts['balls received'] += 1
+
+
+class Command(BaseCommand):
+    help = "Simulate players over HTTP and WebSocket and report latencies."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="Base URL of the server")
+        parser.add_argument('--players', type=int, default=100, help="Number of simulated players")
+        parser.add_argument('--concurrency', type=int, default=50, help="HTTP requests in flight")
+        parser.add_argument('--spawn-rate', type=float, default=50, help="New players per second")
+        parser.add_argument('--mode', help="Game mode to register for, e.g. turbo")
+        parser.add_argument('--cards', type=int, default=1, help="Cards each player buys")
+        parser.add_argument('--protocol', choices=[wire.COMPACT, wire.BINARY], help="Compact WebSocket wire format")
+        parser.add_argument('--prefix', default='loadtest', help="Username prefix of the simulated players")
+        parser.add_argument('--password', default='load-test-Pa55word')
+        parser.add_argument('--timeout', type=float, default=900, help="Seconds to wait for the games to end")
+
+    def handle(self, *args, **options):
+        try:
+            import websockets
+        except ImportError:
+            raise CommandError("load_test needs the websockets package: pip install websockets")
+        self.websockets = websockets
+        self.options = options
+        self.base_url = options['url'].rstrip('/')
+        self.ws_url = 'ws' + self.base_url[len('http'):]
+        self.stats = LoadStats()
+
+        started = time.perf_counter()
+        asyncio.run(self.run())
+        self.report(time.perf_counter() - started)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.options['concurrency']))
+        players = []
+        for index in range(self.options['players']):
+            players.append(asyncio.create_task(self.play(index)))
+            await asyncio.sleep(1 / self.options['spawn_rate'])
+        done, pending = await asyncio.wait(players, timeout=self.options['timeout'])
+        for task in pending:
+            task.cancel()
+        self.stats.counts['timed out'] += len(pending)
+        for task in done:
+            if task.exception() is not None:
+                self.stats.counts['failed'] += 1
+                self.stderr.write(f"Player failed: {task.exception()!r}")
+
+    async def request(self, operation, method, path, data=None, token=None):
+        """Send a JSON request from the thread pool; returns ``(status, body)``."""
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Token {token}'
+        request = urllib.request.Request(
+            self.base_url + path, data=json.dumps(data or {}).encode(), headers=headers, method=method
+        )
+
+        def send():
+            try:
+                with urllib.request.urlopen(request) as response:
+                    return response.status, response.read()
+            except urllib.error.HTTPError as error:
+                return error.code, error.read()
+
+        started = time.perf_counter()
+        status, body = await asyncio.to_thread(send)
+        self.stats.record(operation, time.perf_counter() - started)
+        self.stats.counts[f'{operation} {status}'] += 1
+        try:
+            return status, json.loads(body or b'{}')
+        except ValueError:  # e.g. an HTML error page
+            return status, {}
+
+    async def play(self, index):
+        credentials = {'username': f"{self.options['prefix']}{index}", 'password': self.options['password']}
+        # 400 when the user exists from an earlier run
+        await self.request('signup', 'POST', '/api/auth/users/', credentials)
+        status, body = await self.request('login', 'POST', '/api/auth/token/login/', credentials)
+        if status != 200:
+            return
+        token = body['auth_token']
+
+        data = {'cards': self.options['cards']}
+        if self.options['mode']:
+            data['mode'] = self.options['mode']
+        status, body = await self.request('register', 'POST', '/api/register-to-game', data, token)
+        if status != 201:
+            return
+        game_id, cards = body['game'], [CardMask(numbers) for numbers in body['cards']]
+
+        connecting = time.perf_counter()
+        subprotocols = [self.options['protocol']] if self.options['protocol'] else None
+        async with self.websockets.connect(f"{self.ws_url}/ws/game/{game_id}/", subprotocols=subprotocols) as socket:
+            await socket.send(json.dumps({'token': token, 'last_seq': 0}))
+            claimed = False
+            async for frame in socket:
+                received = time.perf_counter()
+                self.stats.counts['ws bytes received'] += len(frame)
+                if connecting is not None:
+                    self.stats.record('ws handshake', received - connecting)
+                    connecting = None
+
+                for seq, ball in received_balls(frame):
+                    self.stats.ball_received(game_id, seq, received)
+                    for card in cards:
+                        card.mark(ball)
+
+                if not claimed and any(card.is_winner() for card in cards):
+                    claimed = True
+                    await self.request('claim', 'POST', '/api/claim-win', token=token)
+
+    def report(self, elapsed):
+        stats = self.stats
+        self.stdout.write(f"{self.options['players']} players in {elapsed:.1f}s")
+        header = f"{'operation':<14} {'count':>7} {'per s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+        self.stdout.write(header)
+        for operation, latencies in sorted(stats.latencies.items()):
+            latencies.sort()
+            self.stdout.write(
+                f"{operation:<14} {len(latencies):>7} {len(latencies) / elapsed:>8.1f}"
+                + ''.join(f" {percentile(latencies, pct) * 1000:>8.1f}" for pct in (50, 95, 99))
+            )
+        for name, count in sorted(stats.counts.items()):
+            self.stdout.write(f"{name}: {count}")
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from bingoAPI.models import BingoCard
+
+
+class Command(BaseCommand):
+    help = "Pre-generate unique bingo cards for the registration card pools."
+
+    def add_arguments(self, parser):
+        parser.add_argument('count', type=int, help="Number of cards to create")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Cards per INSERT")
+
+    def handle(self, *args, count, batch_size, **options):
+        created = 0
+        while created < count:
+            created += len(BingoCard.create_batch(min(batch_size, count - created), in_pool=True))
+            self.stdout.write(f"Created {created}/{count} cards")
+        self.stdout.write(self.style.SUCCESS(
+            f"{BingoCard.objects.filter(in_pool=True).count()} cards available in the pool"
+        ))
@@ -0,0 +1,129 @@
+"""
+Offline Monte Carlo simulation of how many balls a game lasts and how many
+players share the win, for sizing prize pools and tuning the player cap and
+the ball interval. Needs NumPy; no database or server is involved.
+"""
+import csv
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from bingoAPI.game_loop import game_timings
+
+FIELDS = [
+    'players', 'cards', 'patterns', 'games', 'mean_balls', 'p50_balls', 'p90_balls', 'p99_balls',
+    'min_balls', 'max_balls', 'mean_seconds', 'shared_wins',
+]
+
+
+class Command(BaseCommand):
+    help = "Simulate games to report their length and how often the win is shared."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, nargs='+', default=[10], help="Players per game; several values run a sweep")
+        parser.add_argument('--cards', type=int, nargs='+', default=[1], help="Cards per player; several values run a sweep")
+        parser.add_argument('--games', type=int, default=100_000, help="Games simulated per combination")
+        parser.add_argument('--patterns', default='all', help="Winning patterns: all, lines, rows, columns, diagonals or corners")
+        parser.add_argument('--mode', default=None, help="Game mode whose ball interval converts balls to seconds")
+        parser.add_argument('--workers', type=int, default=1, help="Processes to spread the games over")
+        parser.add_argument('--seed', type=int, default=None, help="Seed, to reproduce a run")
+        parser.add_argument('--format', choices=['csv', 'json'], default='csv')
+        parser.add_argument('--output', help="File to write the report to instead of stdout")
+
+    def handle(self, *args, **options):
+        try:
+            import numpy as np
+            from bingoAPI import simulation
+        except ImportError:
+            raise CommandError("simulate_games needs the numpy package: pip install numpy")
+
+        for name in ('games', 'players', 'cards', 'workers'):
+            values = options[name] if isinstance(options[name], list) else [options[name]]
+            if min(values) < 1:
+                raise CommandError(f"--{name} must be at least 1")
+        if options['patterns'] not in simulation.PATTERN_SETS:
+            raise CommandError(f"Unknown pattern set: {options['patterns']}")
+        mode = options['mode'] or settings.BINGO_GAME_MODE
+        if mode not in settings.BINGO_GAME_MODES:
+            raise CommandError(f"Unknown game mode: {mode}")
+        ball_interval = game_timings(mode)['ball_interval']
+
+        workers = options['workers']
+        rows = []
+        with ProcessPoolExecutor(workers) if workers > 1 else _InlineExecutor() as executor:
+            for players in options['players']:
+                for cards in options['cards']:
+                    # One stream per chunk, restarting for each combination so
+                    # a seed reproduces any row of a sweep on its own
+                    seeds = np.random.SeedSequence(options['seed'])
+                    chunks = [
+                        (players, cards, games, options['patterns'], chunk_seed)
+                        for games, chunk_seed in zip(split(options['games'], workers), seeds.spawn(workers))
+                        if games
+                    ]
+                    lengths = np.zeros(simulation.BALLS + 1, dtype=np.int64)
+                    winners = np.zeros(players + 1, dtype=np.int64)
+                    for chunk_lengths, chunk_winners in executor.map(simulation.simulate_chunk, chunks):
+                        lengths += chunk_lengths
+                        winners += chunk_winners
+                    rows.append(self.summarize(players, cards, options['patterns'], lengths, winners, ball_interval))
+
+        self.write_report(rows, options['format'], options['output'])
+
+    @staticmethod
+    def summarize(players, cards, patterns, lengths, winners, ball_interval):
+        from bingoAPI.simulation import histogram_percentile
+
+        games = int(lengths.sum())
+        draws = range(len(lengths))
+        mean = sum(draw * int(count) for draw, count in zip(draws, lengths)) / games
+        observed = [draw for draw in draws if lengths[draw]]
+        return {
+            'players': players,
+            'cards': cards,
+            'patterns': patterns,
+            'games': games,
+            'mean_balls': round(mean, 2),
+            'p50_balls': histogram_percentile(lengths, 50),
+            'p90_balls': histogram_percentile(lengths, 90),
+            'p99_balls': histogram_percentile(lengths, 99),
+            'min_balls': observed[0],
+            'max_balls': observed[-1],
+            'mean_seconds': round(mean * ball_interval, 1),
+            # Share of games won by more than one player on the same ball
+            'shared_wins': round(int(winners[2:].sum()) / games, 4),
+            'balls_histogram': [int(count) for count in lengths],
+        }
+
+    def write_report(self, rows, format, output):
+        stream = open(output, 'w', newline='') if output else self.stdout
+        try:
+            if format == 'json':
+                stream.write(json.dumps(rows, indent=2) + '\n')
+            else:
+                writer = csv.DictWriter(stream, FIELDS, extrasaction='ignore', lineterminator='\n')
+                writer.writeheader()
+                writer.writerows(rows)
+        finally:
+            if output:
+                stream.close()
+
+
+def split(total, parts):
+    """Split ``total`` into ``parts`` near-equal counts."""
+    return [total // parts + (index < total % parts) for index in range(parts)]
+
+
+class _InlineExecutor:
+    """Runs ``map`` in this process when no worker pool is asked for."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def map(self, function, iterable):
+        return map(function, iterable)
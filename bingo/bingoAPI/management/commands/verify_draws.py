@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bingoAPI.cards import CardMask
+from bingoAPI.draws import draw_order
+from bingoAPI.models import Game, Player
+
+
+def completion_ball(card, order):
+    """Number of balls of ``order`` drawn when ``card`` completes."""
+    return next(seq for seq, ball in enumerate(order, start=1) if card.mark(ball) and card.is_winner())
+
+
+class Command(BaseCommand):
+    help = "Replay games from their draw seed and check the drawn balls and the winner against it."
+
+    def add_arguments(self, parser):
+        parser.add_argument('game_ids', nargs='+', type=int)
+
+    def handle(self, *args, game_ids, **options):
+        failed = False
+        for game_id in game_ids:
+            game = Game.objects.filter(pk=game_id).first()
+            if game is None:
+                raise CommandError(f"Game {game_id} does not exist")
+            if not game.draw_seed:
+                self.stdout.write(self.style.WARNING(f"Game {game_id} has no draw seed; it started before seeds were recorded"))
+                continue
+
+            order = draw_order(game.draw_seed)
+            drawn = game.get_drawn_balls()
+            self.stdout.write(f"Game {game_id}, seed {game.draw_seed}: {len(drawn)} balls drawn")
+            if drawn != order[:len(drawn)]:
+                failed = True
+                seq = next(seq for seq, (ball, expected) in enumerate(zip(drawn, order), start=1) if ball != expected)
+                self.stdout.write(self.style.ERROR(
+                    f"  Ball {seq} was {drawn[seq - 1]}, the seed draws {order[seq - 1]}"
+                ))
+                continue
+
+            player = Player.objects.filter(game=game, user_id=game.winner_id).select_related('user').first()
+            if player is not None:
+                # The winner's first card to complete
+                seq = min(
+                    completion_ball(CardMask(numbers), order)
+                    for numbers in player.cards.values_list('numbers', flat=True)
+                )
+                self.stdout.write(f"  {player.user.username}'s card completes at ball {seq}")
+                if seq > len(drawn):
+                    failed = True
+                    self.stdout.write(self.style.ERROR("  The winner's card was not complete when the game ended"))
+                    continue
+            self.stdout.write(self.style.SUCCESS("  Draws match the seed"))
+
+        if failed:
+            raise CommandError("Some games don't match their draw seed")
@@ -0,0 +1,46 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Exists
+
+from .models import Game, Player
+
+MAX_PLAYERS = 10
+
+
+def find_lobby(user, mode=Game.DEFAULT_MODE):
+    """
+    Return a locked open lobby of game ``mode`` for ``user``: the fullest one
+    with room left, or a new one when they're all full. Returns ``None`` when the user
+    already plays an unfinished game. Must run inside a transaction.
+
+    Lobbies locked by concurrent registrations are skipped, so registrations
+    spread over the open lobbies instead of queueing on one row; a request
+    only waits for a lock when every lobby with room is busy. The user's
+    registrations are checked in the same query as the lock.
+
+    The user's row is locked first, so two registrations of the same user
+    on different workers run one after the other: the second one sees the
+    Player row of the first instead of skipping past its locked lobby.
+    """
+    list(User.objects.select_for_update().filter(pk=user.pk).values_list('pk', flat=True))
+    registered = Player.objects.filter(user=user, game__winner=None)
+    skip_locked = connection.features.has_select_for_update_skip_locked
+    lobby = _lock_lobby(mode, registered, skip_locked=skip_locked)
+    if lobby is None and skip_locked:
+        lobby = _lock_lobby(mode, registered)
+    if lobby is not None:
+        return None if lobby.user_registered else lobby
+    if registered.exists():
+        return None
+    return Game.objects.create(mode=mode)
+
+
+def _lock_lobby(mode, registered, skip_locked=False):
+    # player_count is read under the lock, so the lobby can't fill up meanwhile
+    return (
+        Game.objects.select_for_update(skip_locked=skip_locked)
+        .filter(mode=mode, is_active=False, winner=None, player_count__lt=MAX_PLAYERS)
+        .annotate(user_registered=Exists(registered))
+        .order_by('-player_count', 'id')
+        .first()
+    )
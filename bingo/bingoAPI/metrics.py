@@ -0,0 +1,125 @@
+"""
+In-process metrics of the game loop and the WebSockets, served in the
+Prometheus text format by MetricsView. Each process keeps its own values;
+scrape every worker.
+"""
+import bisect
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds, from a sub-millisecond send to a stalled broadcast
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+registry = []
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation):
+        super().__init__(name, documentation)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self.values) or {(): 0}
+        return [f"{self.name}{format_labels(labels)} {value}" for labels, value in values.items()]
+
+
+class Gauge(Metric):
+    """Gauge set explicitly, or read from ``function`` at every scrape."""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, function=None):
+        super().__init__(name, documentation)
+        self.value = 0
+        self.function = function
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def samples(self):
+        value = self.function() if self.function else self.value
+        return [f"{self.name} {value}"]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+balls_drawn = Counter('bingo_balls_drawn_total', "Balls drawn by this process.")
+draw_commit_seconds = Histogram(
+    'bingo_draw_commit_seconds', "Time from drawing a ball to writing it to the database."
+)
+draw_broadcast_seconds = Histogram(
+    'bingo_draw_broadcast_seconds', "Time from drawing a ball to handing it to the channel layer."
+)
+ball_delivery_seconds = Histogram(
+    'bingo_ball_delivery_seconds', "Time from drawing a ball to sending it on each client socket."
+)
+broadcasts = Counter('bingo_broadcasts_total', "Messages broadcast to game groups, by type.")
+ws_send_seconds = Histogram('bingo_ws_send_seconds', "Time spent sending one broadcast on one socket.")
+ws_send_failures = Counter('bingo_ws_send_failures_total', "Broadcasts that could not be sent to a socket.")
+ws_connections = Gauge('bingo_ws_connections', "Open WebSocket connections.")
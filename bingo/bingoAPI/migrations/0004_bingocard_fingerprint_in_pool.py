@@ -0,0 +1,27 @@
+# Generated by Django 5.1.3 on 2026-10-18 17:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bingoAPI', '0003_alter_bingocard_numbers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bingocard',
+            name='fingerprint',
+            field=models.BigIntegerField(null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='bingocard',
+            name='in_pool',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='bingocard',
+            index=models.Index(condition=models.Q(('in_pool', True)), fields=['id'], name='bingocard_pool_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+import hashlib
+
+from django.db import migrations
+
+
+def card_fingerprint(numbers):
+    # Frozen copy of bingoAPI.cards.card_fingerprint as of this migration
+    data = bytes(num for key in 'BINGO' for num in numbers[key] if num is not None)
+    digest = hashlib.blake2b(data, digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def backfill_fingerprints(apps, schema_editor):
+    """
+    Fill in the fingerprint of existing cards. Cards issued twice while
+    uniqueness was only checked by the application keep no fingerprint on
+    their later copies, so the unique index can still be enforced.
+    """
+    BingoCard = apps.get_model('bingoAPI', 'BingoCard')
+    seen = set(
+        BingoCard.objects.exclude(fingerprint=None).values_list('fingerprint', flat=True)
+    )
+    batch = []
+    for card in BingoCard.objects.filter(fingerprint=None).order_by('id').iterator():
+        fingerprint = card_fingerprint(card.numbers)
+        if fingerprint in seen:
+            continue
+        seen.add(fingerprint)
+        card.fingerprint = fingerprint
+        batch.append(card)
+        if len(batch) >= 1000:
+            BingoCard.objects.bulk_update(batch, ['fingerprint'])
+            batch = []
+    BingoCard.objects.bulk_update(batch, ['fingerprint'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bingoAPI', '0004_bingocard_fingerprint_in_pool'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_fingerprints, migrations.RunPython.noop),
+    ]
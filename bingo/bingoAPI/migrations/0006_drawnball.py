@@ -0,0 +1,48 @@
+# Generated by Django 5.1.3 on 2026-10-18 17:07
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def copy_drawn_balls(apps, schema_editor):
+    """Move the drawn balls of existing games into the DrawnBall log."""
+    Game = apps.get_model('bingoAPI', 'Game')
+    DrawnBall = apps.get_model('bingoAPI', 'DrawnBall')
+    for game in Game.objects.exclude(drawn_balls=[]).iterator():
+        drawn_at = game.start_time or django.utils.timezone.now()
+        DrawnBall.objects.bulk_create(
+            DrawnBall(game=game, seq=seq, number=number, drawn_at=drawn_at)
+            for seq, number in enumerate(game.drawn_balls, start=1)
+        )
+        game.drawn_count = len(game.drawn_balls)
+        game.save(update_fields=['drawn_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bingoAPI', '0005_backfill_bingocard_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='drawn_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='DrawnBall',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveSmallIntegerField()),
+                ('number', models.PositiveSmallIntegerField()),
+                ('drawn_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='draws', to='bingoAPI.game')),
+            ],
+            options={
+                'unique_together': {('game', 'seq')},
+            },
+        ),
+        migrations.RunPython(copy_drawn_balls, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.3 on 2026-10-18 18:02
+
+from django.db import migrations, models
+
+
+def count_players(apps, schema_editor):
+    Game = apps.get_model('bingoAPI', 'Game')
+    for game in Game.objects.annotate(total_players=models.Count('player')).iterator():
+        game.player_count = game.total_players
+        game.save(update_fields=['player_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bingoAPI', '0006_drawnball'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='player_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.RunPython(count_players, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(condition=models.Q(('is_active', False), ('winner', None)), fields=['-player_count', 'id'], name='game_open_lobby_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.3 on 2026-10-18 17:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bingoAPI', '0007_game_player_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='game',
+            name='game_open_lobby_idx',
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='mode',
+            field=models.CharField(default='classic', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(condition=models.Q(('is_active', False), ('winner', None)), fields=['mode', '-player_count', 'id'], name='game_open_lobby_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 17:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bingoAPI', '0008_game_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='draw_seed',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.1.3 on 2026-10-18 17:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_cards(apps, schema_editor):
+    """Issue each player's card to them through the new foreign key."""
+    BingoCard = apps.get_model('bingoAPI', 'BingoCard')
+    Player = apps.get_model('bingoAPI', 'Player')
+    BingoCard.objects.filter(player=None).update(
+        player=Subquery(Player.objects.filter(bingo_card=OuterRef('pk')).values('pk')[:1])
+    )
+
+
+def copy_cards_back(apps, schema_editor):
+    """
+    Give each player back a single card, their first one. Their other cards
+    have no place in the old schema and are deleted.
+    """
+    BingoCard = apps.get_model('bingoAPI', 'BingoCard')
+    Player = apps.get_model('bingoAPI', 'Player')
+    Player.objects.update(
+        bingo_card=Subquery(BingoCard.objects.filter(player=OuterRef('pk')).order_by('pk').values('pk')[:1])
+    )
+    BingoCard.objects.exclude(player=None).exclude(
+        pk__in=Player.objects.values('bingo_card')
+    ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bingoAPI', '0009_game_draw_seed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bingocard',
+            name='player',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='cards', to='bingoAPI.player'),
+        ),
+        # Nullable while the cards are copied, so that reversing can re-add
+        # the column to a table holding players and fill it in afterwards
+        migrations.AlterField(
+            model_name='player',
+            name='bingo_card',
+            field=models.OneToOneField(null=True, on_delete=django.db.models.deletion.CASCADE, to='bingoAPI.bingocard'),
+        ),
+        migrations.RunPython(copy_cards, copy_cards_back),
+        migrations.RemoveField(
+            model_name='player',
+            name='bingo_card',
+        ),
+    ]
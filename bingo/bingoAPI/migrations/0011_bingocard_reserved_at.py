@@ -0,0 +1,33 @@
+# Generated by Django 5.1.3 on 2026-10-18 18:05
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def reserve_orphaned_cards(apps, schema_editor):
+    """
+    Cards neither issued nor in the pool were held by some process's pool.
+    Mark them reserved now; once stale, the sweep returns them to the pool.
+    """
+    BingoCard = apps.get_model('bingoAPI', 'BingoCard')
+    BingoCard.objects.filter(player=None, in_pool=False).update(reserved_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bingoAPI', '0010_player_cards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bingocard',
+            name='reserved_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='bingocard',
+            index=models.Index(condition=models.Q(('player', None), ('reserved_at__isnull', False)), fields=['reserved_at'], name='bingocard_reserved_idx'),
+        ),
+        migrations.RunPython(reserve_orphaned_cards, migrations.RunPython.noop),
+    ]
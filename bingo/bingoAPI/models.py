@@ -1,160 +1,180 @@
-import asyncio
-import time
 from django.contrib.auth.models import User
-from django.db import models
-import random
+from django.db import IntegrityError, models, transaction
 from django.utils import timezone
 import logging
 
-from .consumers import GameConsumer
+from .cards import CardMask, card_fingerprint, generate_card_numbers
+from .draws import new_draw_seed
 
 logger = logging.getLogger(__name__)
 
 class Game(models.Model):
+    DEFAULT_MODE = 'classic'
+
+    # Key of settings.BINGO_GAME_MODES, setting the game's timings
+    mode = models.CharField(max_length=20, default=DEFAULT_MODE)
     is_active = models.BooleanField(default=False)
+    # Snapshot of the draws, written when a game is won; DrawnBall is the log
     drawn_balls = models.JSONField(default=list)
+    drawn_count = models.PositiveSmallIntegerField(default=0)
     players = models.ManyToManyField(User, through='Player')
+    # Kept in step with the Player rows, so lobbies aren't COUNTed on every request
+    player_count = models.PositiveSmallIntegerField(default=0)
     start_time = models.DateTimeField(null=True, blank=True)
+    # Fixes the draw order (see draws.py); set when the game starts
+    draw_seed = models.CharField(max_length=32, blank=True, default='')
     winner = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='won_games')
 
-    def draw_ball(self):
-        if len(self.drawn_balls) < 75:
-            available_balls = set(range(1, 76)) - set(self.drawn_balls)
-            new_ball = random.choice(list(available_balls))
-            self.drawn_balls.append(new_ball)
-            self.save()
-            return new_ball
-        return None
+    class Meta:
+        indexes = [
+            # Matchmaking: open lobbies, fullest first
+            models.Index(
+                fields=['mode', '-player_count', 'id'],
+                name='game_open_lobby_idx',
+                condition=models.Q(is_active=False, winner=None),
+            ),
+        ]
 
     def can_start(self):
-        return self.players.count() >= 2
-
-    # In the Game model
-
-    def start_countdown(self):
-        # Sleep for 30 seconds (non-blocking for the rest of the system)
-        time.sleep(30)  # Simulate countdown time
-        self.refresh_from_db()
-        if not self.is_active:
-            # Game is marked as active after the countdown
-            self.is_active = True
-            self.start_time = timezone.now()
-            self.save()
-            self.start_ball_drawing()
-
-    def start_ball_drawing(self):
-        """Continuously draw balls and notify the WebSocket group."""
-        while self.is_active:
-            time.sleep(5)
-            try:
-                self.refresh_from_db()
-            except self.DoesNotExist:
-                print("Game record no longer exists. Stopping ball drawing.")
-                asyncio.run(GameConsumer.disconnect_all())
-                break
-            new_ball = self.draw_ball()
-
-            if new_ball:
-                letter = self.get_bingo_letter(new_ball)
-                ball_string = f"{letter}{new_ball}"
-                print(f"Generated ball: {ball_string}")
-
-                # Send the ball to all connected clients
-                asyncio.run(GameConsumer.send_to_all({
-                    'type': 'game.ball',
-                    'message': {'ball': ball_string}
-                }))
-            else:
-                print("No new ball. Ending game.")
-                asyncio.run(GameConsumer.disconnect_all())
-                self.delete()
-                break
-
-    def validate_bingo_card(self, player):
-        return player.bingo_card.is_winner(self.drawn_balls)
-
-    def get_bingo_letter(self, number):
-        if 1 <= number <= 15:
-            return 'B'
-        elif 16 <= number <= 30:
-            return 'I'
-        elif 31 <= number <= 45:
-            return 'N'
-        elif 46 <= number <= 60:
-            return 'G'
-        elif 61 <= number <= 75:
-            return 'O'
+        return self.player_count >= 2
+
+    def start(self):
+        """
+        Mark the game as active once its countdown is over. Returns ``False``
+        when it had already started, e.g. from another worker's countdown.
+        """
+        if self.is_active:
+            return False
+        start_time, draw_seed = timezone.now(), new_draw_seed()
+        # One conditional UPDATE, so concurrent countdowns start the game once
+        updated = Game.objects.filter(pk=self.pk, is_active=False, winner=None).update(
+            is_active=True, start_time=start_time, draw_seed=draw_seed
+        )
+        if not updated:
+            return False
+        self.is_active, self.start_time, self.draw_seed = True, start_time, draw_seed
+        return True
+
+    def get_drawn_balls(self, after_seq=0):
+        """Numbers drawn after sequence ``after_seq``, in draw order."""
+        return list(
+            self.draws.filter(seq__gt=after_seq).order_by('seq').values_list('number', flat=True)
+        )
+
+    def validate_cards(self, player):
+        """Whether any of the player's cards has won, in one pass over the drawn balls."""
+        drawn = set(self.get_drawn_balls())
+        return any(
+            CardMask(numbers).mark_drawn(drawn).is_winner()
+            for numbers in player.cards.values_list('numbers', flat=True)
+        )
+
+
+class DrawnBall(models.Model):
+    """Append-only log of the balls of a game; ``seq`` counts from 1."""
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='draws')
+    seq = models.PositiveSmallIntegerField()
+    number = models.PositiveSmallIntegerField()
+    drawn_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ['game', 'seq']
 
 
 class BingoCard(models.Model):
     numbers = models.JSONField()
+    # Digest of the numbers; only legacy duplicate cards have none
+    fingerprint = models.BigIntegerField(unique=True, null=True)
+    # Pre-generated and not yet handed to a CardPool
+    in_pool = models.BooleanField(default=False)
+    # Set when the card is issued; a player may hold several cards
+    player = models.ForeignKey('Player', on_delete=models.CASCADE, null=True, blank=True, related_name='cards')
+    # Set while a CardPool holds the card in memory; reservations left by a
+    # process that went away are returned by release_stale_reservations
+    reserved_at = models.DateTimeField(null=True, blank=True)
+
+    def save(self, *args, **kwargs):
+        if self.fingerprint is None and self.numbers:
+            self.fingerprint = card_fingerprint(self.numbers)
+        super().save(*args, **kwargs)
 
     def generate_unique_card(self):
+        # The unique index on fingerprint decides; a conflict just means retry
         while True:
-            card = {
-                'B': random.sample(range(1, 16), 5),
-                'I': random.sample(range(16, 31), 5),
-                'N': random.sample(range(31, 46), 5),
-                'G': random.sample(range(46, 61), 5),
-                'O': random.sample(range(61, 76), 5),
-            }
-            card['N'][2] = None
-            if not BingoCard.objects.filter(numbers=card).exists():
-                self.numbers = card
-                self.save()
-                break
+            self.numbers = generate_card_numbers()
+            self.fingerprint = card_fingerprint(self.numbers)
+            try:
+                with transaction.atomic():
+                    self.save()
+                return
+            except IntegrityError:
+                continue
+
+    @classmethod
+    def create_batch(cls, count, in_pool=False, reserved_at=None):
+        """
+        Create ``count`` new unique cards with one fingerprint probe and one
+        bulk INSERT per attempt.
+        """
+        created = []
+        while len(created) < count:
+            batch = {}
+            while len(batch) < count - len(created):
+                numbers = generate_card_numbers()
+                batch[card_fingerprint(numbers)] = numbers
+            taken = set(cls.objects.filter(fingerprint__in=batch).values_list('fingerprint', flat=True))
+            cards = [
+                cls(numbers=numbers, fingerprint=fingerprint, in_pool=in_pool, reserved_at=reserved_at)
+                for fingerprint, numbers in batch.items() if fingerprint not in taken
+            ]
+            try:
+                with transaction.atomic():
+                    created += cls.objects.bulk_create(cards)
+            except IntegrityError:
+                # Another writer inserted one of these fingerprints meanwhile
+                continue
+        return created
+
+    @classmethod
+    def take_from_pool(cls, count):
+        """Reserve up to ``count`` pre-generated cards for the calling process."""
+        reserved_at = timezone.now()
+        with transaction.atomic():
+            cards = list(
+                cls.objects.select_for_update(skip_locked=True)
+                .filter(in_pool=True)
+                .order_by('id')[:count]
+            )
+            cls.objects.filter(id__in=[card.id for card in cards]).update(in_pool=False, reserved_at=reserved_at)
+        for card in cards:
+            card.in_pool, card.reserved_at = False, reserved_at
+        return cards
+
+    @classmethod
+    def release_stale_reservations(cls, max_age):
+        """Return to the pool the unissued cards reserved more than ``max_age`` ago."""
+        return cls.objects.filter(player=None, reserved_at__lt=timezone.now() - max_age).update(
+            in_pool=True, reserved_at=None
+        )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(in_pool=True), name='bingocard_pool_idx'),
+            models.Index(
+                fields=['reserved_at'],
+                condition=models.Q(player=None, reserved_at__isnull=False),
+                name='bingocard_reserved_idx',
+            ),
+        ]
+
+    def card_mask(self):
+        return CardMask(self.numbers)
 
     def is_winner(self, drawn_balls):
-        numbers = self.numbers
-        drawn_balls = set(drawn_balls)
-        columns = ['B', 'I', 'N', 'G', 'O']
-
-        rows = [set() for _ in range(5)]
-        cols = [set() for _ in range(5)]
-        diagonals = [set(), set()]
-        corners = set()
-        marked_count = 0
-        total_cells = 0
-
-        for i, col in enumerate(columns):
-            for j, num in enumerate(numbers[col]):
-                total_cells += 1
-
-                # Skip free space
-                if num is None:
-                    marked_count += 1
-                    rows[j].add('FREE')
-                    cols[i].add('FREE')
-                    if i == j:
-                        diagonals[0].add('FREE')
-                    if i + j == 4:
-                        diagonals[1].add('FREE')
-                    continue
-
-                if num in drawn_balls:
-                    marked_count += 1
-                    rows[j].add(num)
-                    cols[i].add(num)
-
-                    if i == j:
-                        diagonals[0].add(num)
-                    if i + j == 4:
-                        diagonals[1].add(num)
-
-                    if (i in {0, 4}) and (j in {0, 4}):
-                        corners.add(num)
-
-        return any([
-            any(len(row) == 5 for row in rows),        # Complete row
-            any(len(col) == 5 for col in cols),        # Complete column
-            any(len(diag) == 5 for diag in diagonals), # Complete diagonal
-            len(corners) == 4,                         # Four corners
-            marked_count == total_cells                # Full card
-        ])
+        return self.card_mask().mark_all(drawn_balls).is_winner()
 
 class Player(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    bingo_card = models.OneToOneField(BingoCard, on_delete=models.CASCADE)
     game = models.ForeignKey(Game, on_delete=models.CASCADE)
 
     class Meta:
@@ -2,5 +2,7 @@ from django.urls import re_path
 from . import consumers
 
 websocket_urlpatterns = [
+    re_path(r'ws/game/(?P<game_id>\d+)/$', consumers.GameConsumer.as_asgi()),
+    # Legacy path: joins the room of the user's current game
     re_path(r'ws/game/$', consumers.GameConsumer.as_asgi()),
 ]
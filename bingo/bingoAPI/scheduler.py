@@ -0,0 +1,198 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+
+from .clock import monotonic
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledCall:
+    """A pending callback in the scheduler heap."""
+    __slots__ = ('deadline', 'key', 'callback', 'args', 'cancelled')
+
+    def __init__(self, deadline, key, callback, args):
+        self.deadline = deadline
+        self.key = key
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class GameScheduler:
+    """
+    Heap of deadlines driving the timers of every game (lobby timeouts,
+    countdowns and ball draws) from a single asyncio event loop.
+
+    The scheduler binds to the ASGI server's loop through SchedulerMiddleware.
+    When nothing has attached it yet (management commands, WSGI) it starts one
+    background thread with its own loop, so the number of threads stays flat
+    no matter how many games are running.
+    """
+
+    def __init__(self, clock=monotonic, autostart=True):
+        self.clock = clock
+        self.autostart = autostart
+        self._heap = []
+        self._counter = itertools.count()
+        self._keys = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+        self._runner = None
+        self._on_attach = []
+
+    def on_attach(self, callback, *args):
+        """Run ``callback(*args)`` once the scheduler first binds to a loop."""
+        self._on_attach.append((callback, args))
+
+    def attach(self, loop=None):
+        """Bind the scheduler to ``loop`` (default: the running loop) and start it."""
+        loop = loop or asyncio.get_running_loop()
+        if self._loop is loop and self._runner is not None:
+            return
+        if self._runner is not None:
+            self._loop.call_soon_threadsafe(self._runner.cancel)
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._runner = loop.create_task(self._run())
+        # Pick up anything scheduled before the loop was known.
+        self._wakeup.set()
+
+        startup, self._on_attach = self._on_attach, []
+        for callback, args in startup:
+            self.schedule(('startup', callback), 0, callback, *args)
+
+    def _start_in_thread(self):
+        loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            self.attach(loop)
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, name='game-scheduler', daemon=True).start()
+        ready.wait()
+
+    def schedule(self, key, delay, callback, *args):
+        """
+        Run ``callback(*args)`` after ``delay`` seconds. Coroutine functions are
+        awaited as tasks on the scheduler loop.
+
+        Only one call may be pending per ``key``: scheduling an existing key
+        returns the pending call untouched.
+        """
+        with self._lock:
+            pending = self._keys.get(key)
+            if pending is not None and not pending.cancelled:
+                return pending
+            call = ScheduledCall(self.clock() + delay, key, callback, args)
+            self._keys[key] = call
+            loop = self._loop
+            heapq.heappush(self._heap, (call.deadline, next(self._counter), call))
+
+        if loop is None:
+            if self.autostart:
+                with self._lock:
+                    if self._loop is None:
+                        self._start_in_thread()
+        elif loop.is_running():
+            loop.call_soon_threadsafe(self._wakeup.set)
+        return call
+
+    def cancel(self, key):
+        """Cancel the pending call for ``key``, if any."""
+        with self._lock:
+            call = self._keys.pop(key, None)
+        if call is not None:
+            call.cancel()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._keys)
+
+    def is_scheduled(self, key):
+        with self._lock:
+            return key in self._keys
+
+    def next_deadline(self):
+        with self._lock:
+            while self._heap and self._heap[0][2].cancelled:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self):
+        """Remove and return every call whose deadline has passed."""
+        now = self.clock()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                call = heapq.heappop(self._heap)[2]
+                if call.cancelled:
+                    continue
+                if self._keys.get(call.key) is call:
+                    del self._keys[call.key]
+                due.append(call)
+        return due
+
+    async def run_due(self):
+        """Run every call that is due, awaiting coroutine callbacks."""
+        for call in self.pop_due():
+            await self._invoke(call)
+
+    async def advance(self, seconds):
+        """
+        Move the scheduler's VirtualClock forward by ``seconds``, running each
+        call at its own deadline, so timers scheduled on the way (the next
+        ball after a draw) fire too.
+        """
+        target = self.clock() + seconds
+        while True:
+            deadline = self.next_deadline()
+            if deadline is None or deadline > target:
+                break
+            self.clock.advance_to(deadline)
+            await self.run_due()
+        self.clock.advance_to(target)
+
+    async def _run(self):
+        while True:
+            for call in self.pop_due():
+                self._loop.create_task(self._invoke(call))
+
+            deadline = self.next_deadline()
+            timeout = None if deadline is None else max(deadline - self.clock(), 0)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _invoke(self, call):
+        try:
+            result = call.callback(*call.args)
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception:
+            logger.exception("Scheduled call %s failed", call.key)
+
+
+class SchedulerMiddleware:
+    """ASGI middleware binding the game scheduler to the server's event loop."""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        scheduler.attach()
+        return await self.inner(scope, receive, send)
+
+
+scheduler = GameScheduler()
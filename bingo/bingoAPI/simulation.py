@@ -0,0 +1,115 @@
+"""
+Monte Carlo simulation of game lengths, vectorized with NumPy (an optional
+dependency, only needed by ``manage.py simulate_games``).
+
+Rather than drawing ball by ball, each simulated game draws a permutation of
+the 75 balls and turns it into the draw at which every ball comes out. The
+draw completing a pattern is the latest of its cells, a card wins at its
+earliest pattern and the game ends at its earliest card, so a batch of games
+is a handful of array reductions.
+"""
+import numpy as np
+
+from .cards import (
+    COLUMN_PATTERNS, COLUMN_RANGES, COLUMNS, DIAGONAL_PATTERNS, FOUR_CORNERS, ROW_PATTERNS, SIZE,
+    WIN_PATTERNS,
+)
+
+CELLS = SIZE * SIZE
+FREE_CELL = CELLS // 2
+BALLS = 75
+
+PATTERN_SETS = {
+    'all': WIN_PATTERNS,
+    'lines': tuple(ROW_PATTERNS + COLUMN_PATTERNS + DIAGONAL_PATTERNS),
+    'rows': tuple(ROW_PATTERNS),
+    'columns': tuple(COLUMN_PATTERNS),
+    'diagonals': tuple(DIAGONAL_PATTERNS),
+    'corners': (FOUR_CORNERS,),
+}
+
+# Cards generated at once, bounding the memory of a batch to tens of MB
+BATCH_CARDS = 200_000
+
+
+def pattern_cells(patterns):
+    """Cell indexes of each pattern, in the row by row layout of ``cards.cell_bit``."""
+    return [np.array([cell for cell in range(CELLS) if pattern >> cell & 1]) for pattern in patterns]
+
+
+def generate_cards(rng, count):
+    """
+    ``count`` random cards as ``(count, 25)`` arrays of numbers, row by row,
+    with 0 on the free space; drawn like ``cards.generate_card_numbers``.
+    """
+    cards = np.zeros((count, SIZE, SIZE), dtype=np.int8)
+    for col, key in enumerate(COLUMNS):
+        numbers = np.arange(COLUMN_RANGES[key].start, COLUMN_RANGES[key].stop, dtype=np.int8)
+        cards[:, :, col] = rng.permuted(np.broadcast_to(numbers, (count, len(numbers))), axis=1)[:, :SIZE]
+    cards = cards.reshape(count, CELLS)
+    cards[:, FREE_CELL] = 0
+    return cards
+
+
+def draw_positions(rng, count):
+    """
+    For ``count`` games, the draw at which each ball comes out, as a
+    ``(count, 76)`` array indexed by ball; ball 0, the free space, is out at 0.
+    """
+    balls = np.broadcast_to(np.arange(1, BALLS + 1, dtype=np.int8), (count, BALLS))
+    order = rng.permuted(balls, axis=1)
+    positions = np.zeros((count, BALLS + 1), dtype=np.int8)
+    np.put_along_axis(positions, order, np.arange(1, BALLS + 1, dtype=np.int8)[None, :], axis=1)
+    return positions
+
+
+def completion_draws(cards, positions, cells):
+    """
+    The draw completing each card: ``cards`` is ``(games, cards, 25)``,
+    ``positions`` comes from ``draw_positions`` and ``cells`` from
+    ``pattern_cells``. Returns a ``(games, cards)`` array.
+    """
+    games = cards.shape[0]
+    times = np.take_along_axis(positions, cards.reshape(games, -1).astype(np.intp), axis=1)
+    times = times.reshape(cards.shape)
+    completed = np.full(cards.shape[:2], BALLS, dtype=np.int8)
+    for indexes in cells:
+        np.minimum(completed, times[:, :, indexes].max(axis=2), out=completed)
+    return completed
+
+
+def simulate(players, cards_per_player, games, patterns='all', seed=None):
+    """
+    Simulate ``games`` games of ``players`` players holding
+    ``cards_per_player`` cards each. Returns ``(lengths, winners)``: the
+    number of games ending at each draw, indexed 0 to 75, and the number of
+    games with each count of players winning on the last ball.
+    """
+    rng = np.random.default_rng(seed)
+    cells = pattern_cells(PATTERN_SETS[patterns])
+    per_game = players * cards_per_player
+    batch = max(BATCH_CARDS // per_game, 1)
+    lengths = np.zeros(BALLS + 1, dtype=np.int64)
+    winners = np.zeros(players + 1, dtype=np.int64)
+
+    for start in range(0, games, batch):
+        count = min(batch, games - start)
+        cards = generate_cards(rng, count * per_game).reshape(count, per_game, CELLS)
+        completed = completion_draws(cards, draw_positions(rng, count), cells)
+        length = completed.min(axis=1)
+        lengths += np.bincount(length, minlength=BALLS + 1)
+        # A player wins with any of their cards
+        won = (completed == length[:, None]).reshape(count, players, cards_per_player).any(axis=2)
+        winners += np.bincount(won.sum(axis=1), minlength=players + 1)
+    return lengths, winners
+
+
+def simulate_chunk(args):
+    """``simulate`` taking one tuple, for process pools."""
+    return simulate(*args)
+
+
+def histogram_percentile(counts, pct):
+    """Nearest-rank percentile of the values counted in ``counts``."""
+    rank = max(int(np.ceil(pct / 100 * counts.sum())), 1)
+    return int(np.searchsorted(np.cumsum(counts), rank))
@@ -0,0 +1,142 @@
+"""
+Query-count and latency budgets of the endpoints and of a complete game.
+
+Meant to run offline on SQLite (``DATABASE_URL=sqlite:///...``); the game
+timers run on a virtual clock, so a whole game takes no real waiting. A budget
+failure lists the queries that were run.
+"""
+import sys
+import time
+from contextlib import contextmanager
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from bingoAPI import game_loop
+from bingoAPI.auth import get_token_user
+from bingoAPI.card_pool import CardPool
+from bingoAPI.clock import VirtualClock
+from bingoAPI.models import Game
+from bingoAPI.scheduler import GameScheduler
+
+# operation: (max queries, max seconds); BEGIN and COMMIT count as queries
+BUDGETS = {
+    # Registration locks the user's row, then issues the player's cards with
+    # one UPDATE, whatever their number
+    'open_lobby': (9, 0.5),
+    'join_lobby': (7, 0.5),
+    'bingo_card': (1, 0.2),
+    # Deleting the player runs in a transaction for the card cache's post_delete;
+    # the player's cards are read, then deleted with it, in one query each
+    'claim_loss': (9, 0.5),
+    'claim_win': (2, 0.5),
+    'start_game': (4, 0.5),
+    'draw_ball': (4, 0.2),
+    # Two registrations, the start, at most 75 draws and the claim
+    'game': (9 + 7 + 4 + 75 * 4 + 2, 10.0),
+}
+
+
+class PerformanceTest(TransactionTestCase):
+    results = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        lines = [f"{'operation':<12} {'runs':>5} {'queries':>8} {'max ms':>8}"]
+        for operation, runs in sorted(cls.results.items()):
+            queries = max(count for count, _ in runs)
+            elapsed = max(seconds for _, seconds in runs)
+            lines.append(f"{operation:<12} {len(runs):>5} {queries:>8} {elapsed * 1000:>8.1f}")
+        sys.stderr.write("\n" + "\n".join(lines) + "\n")
+
+    def setUp(self):
+        cache.clear()
+        self.scheduler = GameScheduler(clock=VirtualClock(), autostart=False)
+        pool = CardPool(size=10, background=False)
+        pool.refill()
+        for patcher in (
+            mock.patch.object(game_loop, 'scheduler', self.scheduler),
+            mock.patch('bingoAPI.views.card_pool', pool),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.users = [User.objects.create_user(username=name, password='secret') for name in ('alice', 'bob')]
+        self.headers = []
+        for user in self.users:
+            token = Token.objects.create(user=user)
+            get_token_user(token.key)  # warm the token cache, as a connected player would have
+            self.headers.append({'HTTP_AUTHORIZATION': f'Token {token.key}'})
+
+    @contextmanager
+    def measure(self, operation):
+        max_queries, max_seconds = BUDGETS[operation]
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            yield
+            elapsed = time.perf_counter() - start
+        self.results.setdefault(operation, []).append((len(queries), elapsed))
+
+        sql = "\n".join(query['sql'] for query in queries.captured_queries)
+        self.assertLessEqual(len(queries), max_queries, f"{operation} ran {len(queries)} queries:\n{sql}")
+        self.assertLessEqual(elapsed, max_seconds, f"{operation} took {elapsed:.3f}s")
+
+    def register(self, index, operation='join_lobby'):
+        with self.measure(operation):
+            response = self.client.post(reverse('register_to_game'), **self.headers[index])
+        self.assertEqual(response.status_code, 201)
+
+    def run_timers(self, timer):
+        async_to_sync(self.scheduler.advance)(game_loop.game_timings('classic')[timer])
+
+    def test_endpoints(self):
+        """Test that registering, fetching a card and claiming stay within budget"""
+        self.register(0, 'open_lobby')
+        self.register(1)
+        with self.measure('bingo_card'):
+            response = self.client.get(reverse('get_bingo_card'), **self.headers[0])
+        self.assertEqual(response.status_code, 200)
+
+        Game.objects.update(is_active=True)
+        # Nothing is drawn yet, so both claims are invalid
+        with self.measure('claim_loss'):
+            response = self.client.post(reverse('claim_win'), **self.headers[1])
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(BINGO_AUTO_WIN=False)
+    def test_full_game(self):
+        """Test that a complete game, from lobby to winning claim, stays within budget"""
+        with self.measure('game'):
+            self.register(0, 'open_lobby')
+            self.register(1)
+            game = Game.objects.get()
+            self.addCleanup(game_loop.stop_game, game.id)
+
+            with self.measure('start_game'):
+                self.run_timers('countdown')
+            self.assertIn(game.id, game_loop.games)
+
+            winner = None
+            while winner is None and game.id in game_loop.games:
+                with self.measure('draw_ball'):
+                    self.run_timers('ball_interval')
+                winner = next(
+                    (index for index, user in enumerate(self.users)
+                     if game_loop.tracked_winner(game.id, user.id)),
+                    None,
+                )
+            self.assertIsNotNone(winner, "The game ended without a winner")
+
+            with self.measure('claim_win'):
+                response = self.client.post(reverse('claim_win'), **self.headers[winner])
+            self.assertEqual(response.status_code, 200)
+
+        game.refresh_from_db()
+        self.assertEqual(game.winner, self.users[winner])
+        self.assertEqual(game.drawn_count, game.draws.count())
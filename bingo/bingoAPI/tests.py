@@ -1,5 +1,36 @@
-from django.test import TestCase
-from bingoAPI.models import BingoCard
+import csv
+import json
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import F
+from django.urls import reverse
+from django.utils import timezone
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.authtoken.models import Token
+from bingoAPI.card_pool import CardPool
+from bingoAPI import game_loop, metrics
+from bingoAPI.auth import get_token_user, token_cache_key
+from bingoAPI.clock import VirtualClock
+from bingoAPI.cards import COLUMNS, WIN_PATTERNS, CardMask, WinTracker, card_fingerprint, generate_card_numbers
+from bingoAPI.consumers import GameConsumer
+from bingoAPI.draws import draw_order, new_draw_seed
+from bingoAPI.game_state import GameState
+from bingoAPI.management.commands.load_test import percentile, received_balls
+from bingoAPI.matchmaking import MAX_PLAYERS, find_lobby
+from bingoAPI.models import BingoCard, DrawnBall, Game, Player
+from bingoAPI.routing import websocket_urlpatterns
+from bingoAPI.scheduler import GameScheduler, scheduler
+from bingoAPI import views, wire
+from bingoAPI.views import ClaimWinView, RegisterToGameView
 
 class BingoCardTest(TestCase):
     def setUp(self):
@@ -43,6 +74,18 @@ class BingoCardTest(TestCase):
             cards.add(str(card.numbers))
         self.assertEqual(len(cards), 5)
 
+    def test_fingerprint_conflict_retries(self):
+        """Test that a card colliding with an existing fingerprint is regenerated"""
+        fresh = generate_card_numbers()
+        with mock.patch('bingoAPI.models.generate_card_numbers',
+                        side_effect=[dict(self.card.numbers), fresh]):
+            card = BingoCard()
+            card.generate_unique_card()
+
+        self.assertEqual(card.numbers, fresh)
+        self.assertEqual(card.fingerprint, card_fingerprint(fresh))
+        self.assertEqual(BingoCard.objects.count(), 2)
+
     def test_row_win(self):
         """Test winning by completing a row"""
         # Test first row
@@ -126,3 +169,992 @@ class BingoCardTest(TestCase):
         """Test with all possible numbers drawn"""
         drawn_balls = set(range(1, 76))
         self.assertTrue(self.card.is_winner(drawn_balls))
+
+
+class CardPoolTest(TestCase):
+    def test_create_batch(self):
+        """Test that a batch of cards gets distinct fingerprints"""
+        cards = BingoCard.create_batch(50)
+        self.assertEqual(len(cards), 50)
+        self.assertTrue(all(card.pk for card in cards))
+        self.assertEqual(len({card.fingerprint for card in cards}), 50)
+        self.assertEqual(cards[0].fingerprint, card_fingerprint(cards[0].numbers))
+
+    def test_seed_cards_command(self):
+        """Test that seeded cards are claimed once by a pool"""
+        call_command('seed_cards', 30, batch_size=20, stdout=StringIO())
+        self.assertEqual(BingoCard.objects.filter(in_pool=True).count(), 30)
+
+        claimed = BingoCard.take_from_pool(20)
+        self.assertEqual(len(claimed), 20)
+        self.assertEqual(BingoCard.objects.filter(in_pool=True).count(), 10)
+        self.assertEqual(len(BingoCard.take_from_pool(20)), 10)
+
+    def test_pop_refills_empty_pool(self):
+        """Test that the pool refills itself up to its size"""
+        BingoCard.create_batch(3, in_pool=True)
+        pool = CardPool(size=10, background=False)
+
+        card = pool.pop()
+        self.assertIsNotNone(card.pk)
+        self.assertEqual(len(pool), 9)
+        self.assertEqual(BingoCard.objects.filter(in_pool=True).count(), 0)
+        self.assertEqual(BingoCard.objects.count(), 10)
+
+        pool.put(card)
+        self.assertEqual(pool.pop(), card)
+
+    def test_stale_reservations_return_to_pool(self):
+        """Test that cards held by a pool that went away are reclaimed, and never issued twice"""
+        pool = CardPool(size=4, background=False, reservation=60)
+        pool.refill()
+        self.assertEqual(BingoCard.objects.filter(in_pool=False, reserved_at__isnull=False).count(), 4)
+
+        # The process exited a minute ago, or is still alive but holds stale cards
+        BingoCard.objects.update(reserved_at=timezone.now() - timedelta(seconds=61))
+        for card in pool._cards:
+            card.reserved_at -= timedelta(seconds=61)
+        self.assertEqual(BingoCard.release_stale_reservations(pool.reservation), 4)
+        self.assertEqual(BingoCard.objects.filter(in_pool=True).count(), 4)
+
+        card = pool.pop()
+        self.assertGreater(card.reserved_at, timezone.now() - timedelta(seconds=30))
+
+
+class MetricsTest(SimpleTestCase):
+    def test_histogram(self):
+        """Test that histograms render cumulative Prometheus buckets"""
+        histogram = metrics.Histogram('test_seconds', "Test.", buckets=(0.1, 1))
+        self.addCleanup(metrics.registry.remove, histogram)
+        for value in (0.05, 0.5, 0.7, 3):
+            histogram.observe(value)
+        self.assertEqual(histogram.samples(), [
+            'test_seconds_bucket{le="0.1"} 1',
+            'test_seconds_bucket{le="1"} 3',
+            'test_seconds_bucket{le="+Inf"} 4',
+            'test_seconds_sum 4.25',
+            'test_seconds_count 4',
+        ])
+
+    def test_metrics_endpoint(self):
+        """Test that the metrics are served in the Prometheus text format"""
+        metrics.broadcasts.inc(type='game.ball')
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        body = response.content.decode()
+        self.assertIn('# TYPE bingo_draw_commit_seconds histogram', body)
+        self.assertIn('bingo_broadcasts_total{type="game.ball"}', body)
+        self.assertIn('bingo_games_drawn 0', body)
+
+    def test_metrics_allowlist(self):
+        """Test that only the allowed addresses may scrape the metrics"""
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.7')
+        self.assertEqual(response.status_code, 403)
+        with self.settings(BINGO_METRICS_IPS=['203.0.113.7']):
+            response = self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.7')
+        self.assertEqual(response.status_code, 200)
+
+
+class LoadTestCommandTest(SimpleTestCase):
+    def test_percentile(self):
+        """Test that percentiles use the nearest rank"""
+        values = list(range(1, 101))
+        self.assertEqual([percentile(values, pct) for pct in (50, 95, 99)], [50, 95, 99])
+        self.assertEqual(percentile([7], 99), 7)
+
+    def test_reads_every_wire_format(self):
+        """Test that simulated players decode balls and catch-ups in any wire format"""
+        for protocol in (wire.JSON, wire.COMPACT, wire.BINARY):
+            self.assertEqual(received_balls(wire.encode_ball(3, 22)[protocol]), [(3, 22)])
+            self.assertEqual(received_balls(wire.encode_catch_up(2, [7, 75])[protocol]), [(2, 7), (3, 75)])
+            self.assertEqual(received_balls(wire.encode_message({
+                'type': 'game.total_players', 'message': {'total_players': 2}
+            })[protocol]), [])
+
+    @mock.patch.dict('sys.modules', {'websockets': None})
+    def test_requires_websockets(self):
+        """Test that the load test explains its missing dependency"""
+        with self.assertRaisesMessage(CommandError, 'websockets'):
+            call_command('load_test', players=1)
+
+
+try:
+    import numpy
+    from bingoAPI import simulation
+except ImportError:
+    numpy = None
+
+
+@skipUnless(numpy, "numpy is not installed")
+class SimulationTest(SimpleTestCase):
+    def test_matches_card_masks(self):
+        """Test that the vectorized completion draws match replaying the balls on card masks"""
+        rng = numpy.random.default_rng(7)
+        cards = simulation.generate_cards(rng, 40 * 3).reshape(40, 3, 25)
+        positions = simulation.draw_positions(rng, 40)
+        completed = simulation.completion_draws(cards, positions, simulation.pattern_cells(WIN_PATTERNS))
+
+        for game, game_cards in enumerate(cards):
+            order = [int(ball) for ball in positions[game, 1:].argsort() + 1]
+            for card, numbers in enumerate(game_cards):
+                mask = CardMask({
+                    key: [int(numbers[row * 5 + col]) or None for row in range(5)]
+                    for col, key in enumerate(COLUMNS)
+                })
+                seq = next(seq for seq, ball in enumerate(order, start=1) if mask.mark(ball) and mask.is_winner())
+                self.assertEqual(completed[game, card], seq)
+
+    def test_report(self):
+        """Test that a sweep reports one row per combination and replays from its seed"""
+        stdout = StringIO()
+        call_command('simulate_games', players=[2, 10], cards=[1, 3], games=300, seed=1, stdout=stdout)
+        rows = list(csv.DictReader(StringIO(stdout.getvalue())))
+        self.assertEqual([(row['players'], row['cards']) for row in rows], [('2', '1'), ('2', '3'), ('10', '1'), ('10', '3')])
+        self.assertTrue(all(row['games'] == '300' for row in rows))
+        self.assertLess(float(rows[-1]['mean_balls']), float(rows[0]['mean_balls']))
+
+        stdout = StringIO()
+        call_command('simulate_games', games=300, seed=1, format='json', stdout=stdout)
+        report, = json.loads(stdout.getvalue())
+        self.assertEqual(sum(report['balls_histogram']), 300)
+        self.assertEqual(report['mean_balls'], float(rows[2]['mean_balls']))
+
+    def test_rejects_empty_games(self):
+        """Test that zero games, players, cards or workers are refused"""
+        for options in ({'games': 0}, {'players': [2, 0]}, {'cards': [0]}, {'workers': 0}):
+            with self.assertRaisesMessage(CommandError, 'at least 1'):
+                call_command('simulate_games', stdout=StringIO(), **options)
+
+    @mock.patch.dict('sys.modules', {'numpy': None})
+    def test_requires_numpy(self):
+        """Test that the simulation explains its missing dependency"""
+        with self.assertRaisesMessage(CommandError, 'numpy'):
+            call_command('simulate_games', games=1)
+
+
+class CardMaskTest(SimpleTestCase):
+    numbers = {
+        'B': [1, 2, 3, 4, 5],
+        'I': [16, 17, 18, 19, 20],
+        'N': [31, 32, None, 34, 35],
+        'G': [46, 47, 48, 49, 50],
+        'O': [61, 62, 63, 64, 65]
+    }
+
+    def test_win_patterns(self):
+        """Test the 12 lines plus four corners are distinct 5- and 4-cell masks"""
+        self.assertEqual(len(WIN_PATTERNS), 13)
+        self.assertEqual(len(set(WIN_PATTERNS)), 13)
+        self.assertTrue(all(bin(p).count('1') == 5 for p in WIN_PATTERNS[:12]))
+        self.assertEqual(bin(WIN_PATTERNS[12]).count('1'), 4)
+
+    def test_free_space_starts_marked(self):
+        """Test that only the free space is marked on a fresh card"""
+        mask = CardMask(self.numbers)
+        self.assertEqual(mask.marks, 1 << 12)
+        self.assertEqual(len(mask.cells), 24)
+
+    def test_incremental_marking(self):
+        """Test that marking balls one at a time detects the win on the last one"""
+        mask = CardMask(self.numbers)
+        self.assertFalse(mask.mark(70))
+        for ball in (1, 17, 49):
+            self.assertTrue(mask.mark(ball))
+            self.assertFalse(mask.is_winner())
+        mask.mark(65)
+        self.assertTrue(mask.is_winner())
+
+
+class WinTrackerTest(SimpleTestCase):
+    def setUp(self):
+        self.tracker = WinTracker()
+        self.tracker.add('alice', CardMaskTest.numbers)
+        self.tracker.add('bob', {
+            'B': [6, 7, 8, 9, 10],
+            'I': [16, 21, 22, 23, 24],
+            'N': [36, 37, None, 39, 40],
+            'G': [51, 52, 53, 54, 55],
+            'O': [66, 67, 68, 69, 70]
+        })
+
+    def test_ball_only_touches_cards_carrying_it(self):
+        """Test that the inverted index maps a ball to the cards carrying it"""
+        self.assertEqual(self.tracker.index[16], ['alice', 'bob'])
+        self.assertEqual(self.tracker.index[1], ['alice'])
+        self.assertNotIn(75, self.tracker.index)
+
+    def test_reports_new_winners_once(self):
+        """Test that a card is reported on the ball that completes it"""
+        for ball in (1, 17, 49):
+            self.assertEqual(self.tracker.mark(ball), [])
+        self.assertEqual(self.tracker.mark(65), ['alice'])
+        self.assertTrue(self.tracker.is_winner('alice'))
+        self.assertFalse(self.tracker.is_winner('bob'))
+        self.assertEqual(self.tracker.mark(2), [])
+
+    def test_add_with_drawn_balls(self):
+        """Test that cards joining late are marked with the balls drawn so far"""
+        self.tracker.add('carol', CardMaskTest.numbers, [1, 16, 31, 46, 61])
+        self.assertTrue(self.tracker.is_winner('carol'))
+
+    def test_remove(self):
+        """Test that removed cards are no longer marked"""
+        self.tracker.remove('alice')
+        self.assertNotIn('alice', self.tracker)
+        self.assertEqual(self.tracker.index[16], ['bob'])
+
+
+class DrawOrderTest(SimpleTestCase):
+    def test_permutation_of_balls(self):
+        """Test that a seed gives a fixed permutation of the 75 balls"""
+        seed = new_draw_seed()
+        order = draw_order(seed)
+        self.assertEqual(sorted(order), list(range(1, 76)))
+        self.assertEqual(draw_order(seed), order)
+        self.assertNotEqual(draw_order(new_draw_seed()), order)
+
+    def test_known_seed(self):
+        """Test that the order of a seed never changes, so old games replay"""
+        self.assertEqual(draw_order('00' * 16)[:5], [50, 70, 24, 35, 33])
+
+
+class GameStateTest(TestCase):
+    def setUp(self):
+        self.game = Game.objects.create(is_active=True)
+        for name in ('alice', 'bob'):
+            user = User.objects.create_user(username=name, password='secret')
+            card = BingoCard(player=Player.objects.create(user=user, game=self.game))
+            card.generate_unique_card()
+
+    def test_load_rebuilds_cards(self):
+        """Test that the state is rebuilt from the database with marked cards"""
+        DrawnBall.objects.bulk_create(
+            DrawnBall(game=self.game, seq=seq, number=number)
+            for seq, number in enumerate(range(1, 76), start=1)
+        )
+        state = GameState.load(self.game)
+
+        self.assertEqual(state.seq, 75)
+        self.assertEqual(len(state.players), 2)
+        self.assertTrue(all(state.is_winner(user_id) for user_id in state.players))
+        self.assertIsNone(state.is_winner(0))
+
+    def test_draw_and_flush(self):
+        """Test that each ball is written with constant-size statements"""
+        state = GameState.load(self.game)
+        ball, _ = state.draw_ball()
+        with self.assertNumQueries(2):
+            self.assertTrue(state.flush())
+
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.drawn_count, 1)
+        self.assertEqual(self.game.get_drawn_balls(), [ball])
+
+    def test_catch_up_range(self):
+        """Test that the balls after a sequence number come back in order"""
+        state = GameState.load(self.game)
+        for _ in range(5):
+            state.draw_ball()
+        state.flush(force=True)
+
+        self.assertEqual(self.game.get_drawn_balls(after_seq=3), state.drawn_balls[3:])
+        self.assertEqual(
+            list(self.game.draws.values_list('seq', flat=True)), [1, 2, 3, 4, 5]
+        )
+
+    def test_finish_writes_snapshot(self):
+        """Test that the finished game keeps a snapshot of its draws"""
+        state = GameState.load(self.game)
+        state.draw_ball()
+        state.finish()
+        self.assertTrue(state.flush())
+
+        self.game.refresh_from_db()
+        self.assertFalse(self.game.is_active)
+        self.assertEqual(self.game.drawn_balls, state.drawn_balls)
+
+    @override_settings(BINGO_FLUSH_EVERY=5)
+    def test_write_behind_batches_balls(self):
+        """Test that balls are only written once a batch is pending"""
+        state = GameState.load(self.game)
+        for _ in range(4):
+            state.draw_ball()
+            with self.assertNumQueries(0):
+                state.flush()
+        state.draw_ball()
+        state.flush()
+
+        self.assertEqual(self.game.get_drawn_balls(), state.drawn_balls)
+        self.assertEqual(len(set(state.drawn_balls)), 5)
+
+    def test_draws_follow_seed(self):
+        """Test that a seeded game draws its balls in the seed's order"""
+        self.game.draw_seed = new_draw_seed()
+        state = GameState.load(self.game)
+        balls = [state.draw_ball()[0] for _ in range(75)]
+        self.assertEqual(balls, draw_order(self.game.draw_seed))
+        self.assertEqual(state.draw_ball(), (None, []))
+
+    def test_verify_draws_command(self):
+        """Test that a finished game replays from its seed and tampering is caught"""
+        self.game.draw_seed = new_draw_seed()
+        self.game.save()
+        alice = Player.objects.get(user__username='alice')
+        state = GameState.load(self.game)
+        while not state.is_winner(alice.user_id):
+            state.draw_ball()
+        state.finish(alice.user_id)
+        state.flush()
+
+        stdout = StringIO()
+        call_command('verify_draws', self.game.id, stdout=stdout)
+        self.assertIn(f"alice's card completes at ball {state.seq}", stdout.getvalue())
+
+        DrawnBall.objects.filter(game=self.game, seq=1).update(number=draw_order(self.game.draw_seed)[1])
+        with self.assertRaises(CommandError):
+            call_command('verify_draws', self.game.id, stdout=StringIO())
+
+    def test_player_with_several_cards(self):
+        """Test that a player wins with any of their cards and is reported once"""
+        alice = Player.objects.get(user__username='alice')
+        BingoCard.objects.filter(pk__in=[card.pk for card in BingoCard.create_batch(3)]).update(player=alice)
+        state = GameState.load(self.game)
+        self.assertEqual(len(state.tracker.cards), 5)
+
+        winners = []
+        while not winners:
+            ball, winners = state.draw_ball()
+        self.assertEqual(len(winners), len(set(winners)))
+        state.flush(force=True)
+        for player in Player.objects.filter(game=self.game):
+            self.assertEqual(self.game.validate_cards(player), state.is_winner(player.user_id))
+
+        state.remove_player(alice.user_id)
+        self.assertIsNone(state.is_winner(alice.user_id))
+        self.assertEqual(len(state.tracker.cards), 1)
+
+    def test_game_starts_once(self):
+        """Test that two countdowns firing together start the game once"""
+        first, second = Game.objects.get(pk=self.game.pk), Game.objects.get(pk=self.game.pk)
+        Game.objects.filter(pk=self.game.pk).update(is_active=False)
+        first.is_active = second.is_active = False
+        self.assertTrue(first.start())
+        self.assertFalse(second.start())
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.draw_seed, first.draw_seed)
+
+    def test_failed_flush_drops_state(self):
+        """Test that a draw whose balls couldn't be written forgets the game"""
+        game_loop.games[self.game.id] = GameState.load(self.game)
+        self.addCleanup(game_loop.games.pop, self.game.id, None)
+        with mock.patch.object(GameState, 'flush', side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                async_to_sync(game_loop.draw_next_ball)(self.game.id)
+        self.assertNotIn(self.game.id, game_loop.games)
+
+    def test_failed_flush_is_retried(self):
+        """Test that a ball that couldn't be saved is saved by a later retry"""
+        state = game_loop.games[self.game.id] = GameState.load(self.game)
+        self.addCleanup(game_loop.stop_game, self.game.id)
+        with mock.patch.object(GameState, 'flush', side_effect=OperationalError), \
+                self.assertLogs('bingoAPI.game_loop', 'ERROR'):
+            async_to_sync(game_loop.draw_next_ball)(self.game.id)
+        self.assertIs(game_loop.games[self.game.id], state)
+        self.assertTrue(scheduler.is_scheduled(('ball', self.game.id)))
+        self.assertEqual(len(state.pending), 1)
+
+        scheduler.cancel(('ball', self.game.id))
+        with mock.patch.object(game_loop, 'schedule_next_ball'):
+            async_to_sync(game_loop.commit_ball)(self.game.id, state.drawn_balls[0], 0, 1)
+        self.assertEqual(self.game.get_drawn_balls(), state.drawn_balls)
+
+    def test_unsaved_game_is_ended(self):
+        """Test that a game whose balls can't be saved releases its players"""
+        game_loop.games[self.game.id] = GameState.load(self.game)
+        self.addCleanup(game_loop.stop_game, self.game.id)
+        with mock.patch.object(GameState, 'flush', side_effect=OperationalError), \
+                mock.patch.object(game_loop, 'FLUSH_RETRIES', 0), \
+                self.assertLogs('bingoAPI.game_loop', 'ERROR'):
+            async_to_sync(game_loop.draw_next_ball)(self.game.id)
+        self.assertNotIn(self.game.id, game_loop.games)
+        self.assertFalse(Game.objects.filter(pk=self.game.id).exists())
+
+    @override_settings(BINGO_FLUSH_EVERY=5)
+    def test_commit_latency_counts_written_draws(self):
+        """Test that draws left pending aren't observed as committed"""
+        game_loop.games[self.game.id] = GameState.load(self.game)
+        self.addCleanup(game_loop.games.pop, self.game.id, None)
+        observed = metrics.draw_commit_seconds.counts[:]
+        with mock.patch.object(game_loop, 'schedule_next_ball'):
+            for _ in range(5):
+                async_to_sync(game_loop.draw_next_ball)(self.game.id)
+        self.assertEqual(sum(metrics.draw_commit_seconds.counts) - sum(observed), 1)
+
+    def test_auto_win_skips_disqualified_player(self):
+        """Test that a winner disqualified by another worker can't be settled as the winner"""
+        state = GameState.load(self.game)
+        winners = []
+        while not winners:
+            _, winners = state.draw_ball()
+        state.finish(winners[0])
+        Player.objects.filter(game=self.game, user_id=winners[0]).delete()
+
+        self.assertTrue(state.flush())
+        self.assertNotIn(winners[0], state.players)
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.is_active, self.game.winner_id), (state.is_active, state.winner_id))
+        self.assertEqual(state.winner_id, winners[1] if len(winners) > 1 else None)
+        self.assertEqual(self.game.drawn_count, state.seq)
+
+    def test_flush_detects_game_settled_elsewhere(self):
+        """Test that flushing a game finished by another request reports it"""
+        state = GameState.load(self.game)
+        Game.objects.filter(pk=self.game.pk).update(is_active=False)
+        state.draw_ball()
+        self.assertFalse(state.flush())
+
+
+class GameSchedulerTest(SimpleTestCase):
+    def setUp(self):
+        self.now = 0
+        self.scheduler = GameScheduler(clock=lambda: self.now, autostart=False)
+        self.calls = []
+
+    def record(self, name):
+        self.calls.append(name)
+
+    def test_runs_calls_in_deadline_order(self):
+        """Test that due calls run earliest deadline first"""
+        self.scheduler.schedule('b', 5, self.record, 'b')
+        self.scheduler.schedule('a', 1, self.record, 'a')
+        self.scheduler.schedule('c', 30, self.record, 'c')
+
+        self.now = 10
+        async_to_sync(self.scheduler.run_due)()
+        self.assertEqual(self.calls, ['a', 'b'])
+        self.assertTrue(self.scheduler.is_scheduled('c'))
+
+    def test_one_pending_call_per_key(self):
+        """Test that rescheduling a pending key is a no-op"""
+        self.scheduler.schedule(('countdown', 1), 30, self.record, 'first')
+        self.scheduler.schedule(('countdown', 1), 30, self.record, 'second')
+
+        self.now = 30
+        async_to_sync(self.scheduler.run_due)()
+        self.assertEqual(self.calls, ['first'])
+
+    def test_cancel(self):
+        """Test that cancelled calls never run"""
+        self.scheduler.schedule('timeout', 60, self.record, 'timeout')
+        self.scheduler.cancel('timeout')
+
+        self.now = 60
+        async_to_sync(self.scheduler.run_due)()
+        self.assertEqual(self.calls, [])
+        self.assertIsNone(self.scheduler.next_deadline())
+
+    def test_awaits_coroutines(self):
+        """Test that coroutine callbacks are awaited"""
+        async def draw(ball):
+            self.calls.append(ball)
+
+        self.scheduler.schedule('ball', 5, draw, 42)
+        self.now = 5
+        async_to_sync(self.scheduler.run_due)()
+        self.assertEqual(self.calls, [42])
+
+    def test_advance_virtual_clock(self):
+        """Test that advancing a virtual clock runs timers scheduled on the way"""
+        clock = VirtualClock()
+        scheduler = GameScheduler(clock=clock, autostart=False)
+
+        def draw(ball):
+            self.calls.append((ball, clock()))
+            scheduler.schedule('ball', 5, draw, ball + 1)
+
+        scheduler.schedule('ball', 5, draw, 1)
+        async_to_sync(scheduler.advance)(17)
+        self.assertEqual(self.calls, [(1, 5), (2, 10), (3, 15)])
+        self.assertEqual(clock(), 17)
+        self.assertEqual(scheduler.next_deadline(), 20)
+
+
+class TokenCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='alice', password='secret')
+        self.token = Token.objects.create(user=self.user)
+
+    def test_lookup_is_cached(self):
+        """Test that a token is looked up with one query, then from the cache"""
+        with self.assertNumQueries(1):
+            self.assertEqual(get_token_user(self.token.key), self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_token_user(self.token.key), self.user)
+
+    def test_cache_holds_no_password(self):
+        """Test that the cached entry carries no password hash"""
+        get_token_user(self.token.key)
+        self.assertNotIn(self.user.password, repr(cache.get(token_cache_key(self.token.key))))
+        with self.assertNumQueries(0):
+            self.assertEqual(get_token_user(self.token.key).username, 'alice')
+
+    def test_deactivation_invalidates_cache(self):
+        """Test that a deactivated user loses access right away"""
+        get_token_user(self.token.key)
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertIsNone(get_token_user(self.token.key))
+
+    def test_unknown_token(self):
+        """Test that unknown tokens are rejected"""
+        self.assertIsNone(get_token_user('missing'))
+
+    def test_logout_invalidates_cache(self):
+        """Test that deleting the token (djoser logout) drops the cached user"""
+        get_token_user(self.token.key)
+        Token.objects.filter(user=self.user).delete()
+        self.assertIsNone(get_token_user(self.token.key))
+
+
+class GameEndpointsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        for patcher in (
+            mock.patch.object(scheduler, 'autostart', False),
+            # Cards of the shared pool would outlive this test's transaction
+            mock.patch('bingoAPI.views.card_pool', CardPool(size=5, background=False)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.users = [User.objects.create_user(username=name, password='secret') for name in ('alice', 'bob')]
+        self.headers = [{'HTTP_AUTHORIZATION': f'Token {Token.objects.create(user=user).key}'} for user in self.users]
+
+    def register(self, index=0):
+        return self.client.post(reverse('register_to_game'), **self.headers[index])
+
+    def test_requires_token(self):
+        """Test that requests without a valid token are rejected"""
+        self.assertEqual(self.client.post(reverse('register_to_game')).status_code, 401)
+        response = self.client.get(reverse('get_bingo_card'), HTTP_AUTHORIZATION='Token nope')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+
+    def test_register_and_fetch_card(self):
+        """Test that a registered player gets their card back"""
+        response = self.register()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['player'], 'alice')
+
+        card = self.client.get(reverse('get_bingo_card'), **self.headers[0])
+        self.assertEqual(card.status_code, 200)
+        self.assertEqual(card.json()['card'], response.json()['card'])
+
+    def test_card_revalidation(self):
+        """Test that polling a card the client holds is a 304 without queries"""
+        game_id = self.register().json()['game']
+        card = self.client.get(reverse('get_bingo_card'), **self.headers[0])
+        self.assertEqual(card.status_code, 200)
+        self.assertEqual(self.client.get(reverse('get_bingo_card'), {'game': game_id}, **self.headers[0])['ETag'], card['ETag'])
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('get_bingo_card'), HTTP_IF_NONE_MATCH=card['ETag'], **self.headers[0])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], card['ETag'])
+
+        Player.objects.filter(user=self.users[0]).delete()
+        for params in ({}, {'game': game_id}):
+            response = self.client.get(reverse('get_bingo_card'), params, **self.headers[0])
+            self.assertEqual(response.status_code, 400)
+
+    def test_latest_card_follows_new_registration(self):
+        """Test that the latest-card entry is dropped once a new registration commits"""
+        first = self.register().json()
+        self.assertEqual(self.client.get(reverse('get_bingo_card'), **self.headers[0]).json()['cards'], first['cards'])
+        Game.objects.filter(pk=first['game']).update(winner=self.users[1])
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            second = self.register().json()
+        self.assertTrue(callbacks)
+        self.assertEqual(self.client.get(reverse('get_bingo_card'), **self.headers[0]).json()['cards'], second['cards'])
+        response = self.client.get(reverse('get_bingo_card'), {'game': 0}, **self.headers[0])
+        self.assertEqual(response.status_code, 400)
+
+    def test_second_player_schedules_countdown(self):
+        """Test that the lobby timeout and the countdown are scheduled once"""
+        self.register(0)
+        game = Game.objects.get()
+        self.addCleanup(game_loop.stop_game, game.id)
+        self.assertTrue(scheduler.is_scheduled(('timeout', game.id)))
+        self.assertFalse(scheduler.is_scheduled(('countdown', game.id)))
+
+        self.register(1)
+        self.assertTrue(scheduler.is_scheduled(('countdown', game.id)))
+        game.refresh_from_db()
+        self.assertEqual(game.player_count, 2)
+        self.assertTrue(game.can_start())
+
+    def test_lobby_timeout(self):
+        """Test that the lobby timeout cancels a lonely lobby but not one that filled up"""
+        self.register(0)
+        game = Game.objects.get()
+        self.addCleanup(game_loop.stop_game, game.id)
+        self.register(1)
+        async_to_sync(game_loop.check_timeout)(game.id)
+        self.assertTrue(Game.objects.filter(pk=game.id).exists())
+
+        Player.objects.filter(game=game, user=self.users[1]).delete()
+        Game.objects.filter(pk=game.id).update(player_count=1)
+        async_to_sync(game_loop.check_timeout)(game.id)
+        self.assertFalse(Game.objects.filter(pk=game.id).exists())
+        self.assertFalse(Player.objects.exists())
+
+    def test_registration_queries(self):
+        """Test that joining an open lobby takes two locks, an insert and two updates"""
+        views.card_pool.refill()
+        lobby = Game.objects.create()
+
+        with self.assertNumQueries(7):  # plus SAVEPOINT and RELEASE inside the test transaction
+            response, game, total_players = RegisterToGameView().register(self.users[0])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((game, total_players), (lobby, 1))
+
+    def test_failed_registration_returns_cards(self):
+        """Test that cards popped for a registration that fails go back to the pool"""
+        views.card_pool.refill()
+        Game.objects.create()
+        with mock.patch.object(Player.objects, 'create', side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                RegisterToGameView().register(self.users[0], count=2)
+        self.assertEqual(len(views.card_pool), 5)
+
+    def test_register_several_cards(self):
+        """Test that cards bought together are issued with the same queries as one"""
+        views.card_pool.refill()
+        Game.objects.create()
+
+        with self.assertNumQueries(7):
+            response, game, _ = RegisterToGameView().register(self.users[0], count=3)
+        cards = json.loads(response.content)['cards']
+        self.assertEqual(len(cards), 3)
+        player = Player.objects.get(user=self.users[0])
+        self.assertEqual(list(player.cards.order_by('id').values_list('numbers', flat=True)), cards)
+
+        response = self.client.get(reverse('get_bingo_card'), **self.headers[0])
+        self.assertEqual(response.json()['cards'], cards)
+        self.assertEqual(response.json()['card'], cards[0])
+
+    def test_card_count_limits(self):
+        """Test that buying no cards, too many or a non-number is refused"""
+        for count in (0, settings.BINGO_MAX_CARDS + 1, 'two'):
+            response = self.client.post(reverse('register_to_game'), {'cards': count},
+                                        content_type='application/json', **self.headers[0])
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Game.objects.exists())
+
+    def test_register_for_game_mode(self):
+        """Test that players are matched per game mode and timed by it"""
+        virtual_scheduler = GameScheduler(clock=VirtualClock(), autostart=False)
+        with mock.patch.object(game_loop, 'scheduler', virtual_scheduler):
+            response = self.client.post(reverse('register_to_game'), {'mode': 'turbo'},
+                                        content_type='application/json', **self.headers[0])
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(virtual_scheduler.next_deadline(), settings.BINGO_GAME_MODES['turbo']['lobby_timeout'])
+            self.register(1)
+
+        turbo, classic = Game.objects.order_by('id')
+        self.assertEqual((turbo.mode, turbo.player_count), ('turbo', 1))
+        self.assertEqual((classic.mode, classic.player_count), ('classic', 1))
+
+    def test_unknown_game_mode(self):
+        """Test that registering for a mode that doesn't exist is refused"""
+        response = self.client.post(reverse('register_to_game'), {'mode': 'blitz'}, **self.headers[0])
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse('register_to_game'), {'mode': {'a': 1}},
+                                    content_type='application/json', **self.headers[0])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Game.objects.exists())
+
+    def test_malformed_json(self):
+        """Test that a body that isn't a JSON object is refused"""
+        for body in ('{"mode": ', '[1]'):
+            response = self.client.post(reverse('register_to_game'), body,
+                                        content_type='application/json', **self.headers[0])
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {"error": "Malformed JSON"})
+        self.assertFalse(Game.objects.exists())
+
+    def test_claim_without_active_game(self):
+        """Test that claiming outside a running game is refused"""
+        response = self.client.post(reverse('claim_win'), **self.headers[0])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "No active game"})
+
+    def test_claim_win_and_disqualification(self):
+        """Test that a valid claim wins and an invalid one disqualifies"""
+        self.register(0)
+        self.register(1)
+        game = Game.objects.get()
+        self.addCleanup(game_loop.stop_game, game.id)
+        game.start()
+        alice = Player.objects.get(user=self.users[0])
+        DrawnBall.objects.bulk_create(
+            DrawnBall(game=game, seq=seq, number=number)
+            for seq, number in enumerate(alice.cards.get().numbers['B'], start=1)
+        )
+        if game.validate_cards(Player.objects.get(user=self.users[1])):
+            self.skipTest("Both random cards won")
+
+        response = self.client.post(reverse('claim_win'), **self.headers[1])
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Player.objects.filter(user=self.users[1]).exists())
+        game.refresh_from_db()
+        self.assertEqual(game.player_count, 1)
+
+        response = self.client.post(reverse('claim_win'), **self.headers[0])
+        self.assertEqual(response.status_code, 200)
+        game.refresh_from_db()
+        self.assertEqual(game.winner, self.users[0])
+        self.assertFalse(game.is_active)
+        self.assertEqual(game.drawn_balls, alice.cards.get().numbers['B'])
+
+
+    def test_only_first_claim_wins(self):
+        """Test that racing claims settle the game exactly once"""
+        game = Game.objects.create(is_active=True)
+        for user in self.users:
+            Player.objects.create(user=user, game=game)
+        settle = async_to_sync(ClaimWinView.settle)
+        self.assertTrue(settle(game, self.users[0]))
+        self.assertFalse(settle(game, self.users[1]))
+        game.refresh_from_db()
+        self.assertEqual(game.winner, self.users[0])
+
+    def test_disqualified_player_cannot_settle(self):
+        """Test that a user without a Player row in the game can't be made its winner"""
+        game = Game.objects.create(is_active=True)
+        self.assertFalse(async_to_sync(ClaimWinView.settle)(game, self.users[0]))
+        game.refresh_from_db()
+        self.assertTrue(game.is_active)
+
+    def test_claims_find_the_players_game(self):
+        """Test that a claim is judged in the player's own game"""
+        other = Game.objects.create(is_active=True)
+        self.register(0)
+        self.assertEqual(self.client.post(reverse('claim_win'), **self.headers[0]).json(),
+                         {"error": "Player not registered in the game"})
+        Game.objects.exclude(pk=other.pk).update(is_active=True)
+        self.addCleanup(game_loop.stop_game, Game.objects.exclude(pk=other.pk).get().id)
+        self.assertEqual(self.client.post(reverse('claim_win'), **self.headers[0]).status_code, 403)
+        self.assertFalse(Game.objects.exclude(pk=other.pk).exists())
+
+
+class MatchmakingTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='newcomer')
+
+    def fill(self, game, count):
+        for _ in range(count):
+            user = User.objects.create_user(username=f'player{User.objects.count()}')
+            Player.objects.create(user=user, game=game)
+        Game.objects.filter(pk=game.pk).update(player_count=F('player_count') + count)
+
+    def test_fullest_lobby_with_room(self):
+        """Test that players join the fullest lobby that isn't full"""
+        emptier, fuller, full = Game.objects.create(), Game.objects.create(), Game.objects.create()
+        self.fill(emptier, 2)
+        self.fill(fuller, 7)
+        self.fill(full, MAX_PLAYERS)
+        Game.objects.create(is_active=True)
+
+        with transaction.atomic():
+            self.assertEqual(find_lobby(self.user), fuller)
+
+    def test_new_lobby_when_all_full(self):
+        """Test that a new lobby is opened when every lobby is full"""
+        full = Game.objects.create()
+        self.fill(full, MAX_PLAYERS)
+
+        with transaction.atomic():
+            lobby = find_lobby(self.user)
+        self.assertNotEqual(lobby, full)
+        self.assertEqual(Game.objects.count(), 2)
+
+    @mock.patch('bingoAPI.views.card_pool', CardPool(size=1, background=False))
+    def test_already_registered(self):
+        """Test that a player waiting in a lobby can't join another one"""
+        lobby = Game.objects.create()
+        self.fill(lobby, MAX_PLAYERS)
+        user = User.objects.filter(player__game=lobby).first()
+        token = Token.objects.create(user=user)
+        response = self.client.post(reverse('register_to_game'), HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Game.objects.count(), 1)
+
+    def test_registered_user_gets_no_lobby(self):
+        """Test that matchmaking refuses a user who already plays a game"""
+        lobby = Game.objects.create()
+        self.fill(lobby, 1)
+        Player.objects.create(user=self.user, game=Game.objects.create(is_active=True))
+
+        with transaction.atomic():
+            self.assertIsNone(find_lobby(self.user))
+        Game.objects.filter(pk=lobby.pk).update(player_count=MAX_PLAYERS)
+        with transaction.atomic():
+            self.assertIsNone(find_lobby(self.user))
+        self.assertEqual(Game.objects.count(), 2)
+
+
+class GameConsumerTest(TransactionTestCase):
+    def setUp(self):
+        self.game = Game.objects.create()
+        self.other_game = Game.objects.create()
+        self.tokens = [
+            self.create_player('alice', self.game),
+            self.create_player('bob', self.game),
+            self.create_player('carol', self.other_game),
+        ]
+
+    def create_player(self, username, game):
+        user = User.objects.create_user(username=username, password='secret')
+        card = BingoCard(player=Player.objects.create(user=user, game=game))
+        card.generate_unique_card()
+        Game.objects.filter(pk=game.pk).update(player_count=F('player_count') + 1)
+        return Token.objects.create(user=user).key
+
+    async def connect(self, token, path='/ws/game/'):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.send_json_to({'token': token})
+        return communicator
+
+    async def test_broadcast_reaches_game_group(self):
+        """Test that a game broadcast reaches every socket of the game once"""
+        alice = await self.connect(self.tokens[0])
+        self.assertEqual(await alice.receive_json_from(), {
+            'type': 'game.total_players', 'message': {'total_players': 2}
+        })
+        bob = await self.connect(self.tokens[1])
+        await alice.receive_json_from()
+        await bob.receive_json_from()
+
+        message = {'type': 'game.ball', 'message': {'ball': 'B7'}}
+        await GameConsumer.send_to_game(self.game.id, message)
+        self.assertEqual(await alice.receive_json_from(), message)
+        self.assertEqual(await bob.receive_json_from(), message)
+
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_rooms_are_scoped_to_their_game(self):
+        """Test that balls and disconnects only reach the players of that game"""
+        alice = await self.connect(self.tokens[0], f'/ws/game/{self.game.id}/')
+        await alice.receive_json_from()
+        carol = await self.connect(self.tokens[2], f'/ws/game/{self.other_game.id}/')
+        self.assertEqual(await carol.receive_json_from(), {
+            'type': 'game.total_players', 'message': {'total_players': 1}
+        })
+
+        message = {'type': 'game.ball', 'message': {'ball': 'B7'}}
+        await GameConsumer.send_to_game(self.other_game.id, message)
+        self.assertEqual(await carol.receive_json_from(), message)
+        self.assertTrue(await alice.receive_nothing())
+
+        await GameConsumer.disconnect_game(self.other_game.id)
+        self.assertEqual((await carol.receive_output())['type'], 'websocket.close')
+        self.assertTrue(await alice.receive_nothing())
+        await alice.disconnect()
+
+    async def test_authenticates_once(self):
+        """Test that only the first message of a socket is authenticated"""
+        alice = await self.connect(self.tokens[0])
+        await alice.receive_json_from()
+
+        with mock.patch.object(GameConsumer, 'authenticate') as authenticate:
+            await alice.send_json_to({'message': 'hello'})
+            self.assertTrue(await alice.receive_nothing())
+        authenticate.assert_not_called()
+        await alice.disconnect()
+
+    async def test_catch_up_from_database(self):
+        """Test that a reconnecting client gets the balls it missed"""
+        await DrawnBall.objects.abulk_create(
+            DrawnBall(game=self.game, seq=seq, number=number)
+            for seq, number in enumerate([7, 22, 40], start=1)
+        )
+        alice = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/game/{self.game.id}/')
+        await alice.connect()
+        await alice.send_json_to({'token': self.tokens[0], 'last_seq': 1})
+
+        # Sent straight to the socket, ahead of the room's queued broadcasts
+        self.assertEqual(await alice.receive_json_from(), {
+            'type': 'game.catch_up',
+            'message': {'balls': [{'ball': 'I22', 'seq': 2}, {'ball': 'N40', 'seq': 3}]}
+        })
+        self.assertEqual((await alice.receive_json_from())['type'], 'game.total_players')
+        await alice.disconnect()
+
+    async def test_catch_up_from_game_state(self):
+        """Test that balls not flushed yet are replayed from memory"""
+        game_loop.games[self.game.id] = GameState(self.game.id, [7, 22, 40])
+        self.addCleanup(game_loop.games.pop, self.game.id)
+
+        alice = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/game/{self.game.id}/')
+        await alice.connect()
+        await alice.send_json_to({'token': self.tokens[0], 'last_seq': 0})
+
+        message = await alice.receive_json_from()
+        self.assertEqual([ball['seq'] for ball in message['message']['balls']], [1, 2, 3])
+        await alice.disconnect()
+
+    async def test_ignores_invalid_last_seq(self):
+        """Test that a last_seq outside the game's sequence numbers replays nothing"""
+        await DrawnBall.objects.abulk_create([DrawnBall(game=self.game, seq=1, number=7)])
+        for last_seq in (-1, 300, 'x', None):
+            alice = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/game/{self.game.id}/',
+                                          subprotocols=[wire.BINARY])
+            await alice.connect()
+            await alice.send_json_to({'token': self.tokens[0], 'last_seq': last_seq})
+            self.assertEqual(await alice.receive_from(), '["p",2]')
+            self.assertTrue(await alice.receive_nothing())
+            await alice.disconnect()
+
+    async def test_compact_wire_formats(self):
+        """Test that clients picking a subprotocol get balls as JSON arrays or binary frames"""
+        await DrawnBall.objects.abulk_create([DrawnBall(game=self.game, seq=1, number=7)])
+        sockets = {}
+        for index, protocol in enumerate((wire.COMPACT, wire.BINARY)):
+            socket = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/game/{self.game.id}/',
+                                           subprotocols=['bingo.v9', protocol])
+            self.assertEqual(await socket.connect(), (True, protocol))
+            await socket.send_json_to({'token': self.tokens[index], 'last_seq': 0})
+            sockets[protocol] = socket
+
+        self.assertEqual(await sockets[wire.COMPACT].receive_from(), '["c",1,[7]]')
+        self.assertEqual(await sockets[wire.BINARY].receive_from(), bytes((wire.CATCH_UP_FRAME, 1, 7)))
+        # The player count, broadcast when each socket joined
+        self.assertEqual(await sockets[wire.BINARY].receive_from(), '["p",2]')
+        for _ in range(2):
+            self.assertEqual(await sockets[wire.COMPACT].receive_from(), '["p",2]')
+
+        await GameConsumer.send_ball(self.game.id, 2, 22)
+        self.assertEqual(await sockets[wire.COMPACT].receive_from(), '["b",2,22]')
+        self.assertEqual(await sockets[wire.BINARY].receive_from(), bytes((wire.BALL_FRAME, 2, 22)))
+        for socket in sockets.values():
+            await socket.disconnect()
+
+    async def test_rejects_other_games_room(self):
+        """Test that a player can't join the room of a game they don't play"""
+        carol = await self.connect(self.tokens[2], f'/ws/game/{self.game.id}/')
+        self.assertEqual((await carol.receive_output())['type'], 'websocket.close')
+
+    async def test_disconnect_game(self):
+        """Test that finishing a game closes its sockets"""
+        alice = await self.connect(self.tokens[0])
+        await alice.receive_json_from()
+
+        await GameConsumer.disconnect_game(self.game.id)
+        self.assertEqual((await alice.receive_output())['type'], 'websocket.close')
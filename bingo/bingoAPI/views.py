@@ -1,122 +1,230 @@
-import asyncio
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.db import transaction
+from django.db.models import Exists, F
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status
-from rest_framework.views import APIView
-from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from . import metrics
+from .auth import get_token_user
+from .card_cache import get_player_card
 from .models import BingoCard, Player, Game
+from .card_pool import card_pool
 from .consumers import GameConsumer
-import threading
-
-class RegisterToGameView(APIView):
-    permission_classes = [IsAuthenticated]
-    countdown_lock = threading.Lock()
-
-    def post(self, request):
-        user = request.user
-
-        with transaction.atomic():
-            game, created = Game.objects.get_or_create(is_active=False, winner=None)
-
-            if game.players.count() >= 10:
-                return Response({"error": "Game is full"}, status=status.HTTP_400_BAD_REQUEST)
-
-            if Player.objects.filter(user=user, game__is_active=True).exists():
-                return Response({"error": "User is already registered for an active game"}, status=status.HTTP_400_BAD_REQUEST)
-
-            card = BingoCard()
-            card.generate_unique_card()
-
-            player = Player.objects.create(user=user, bingo_card=card, game=game)
-            game.players.add(user)
-
-        if game.players.count() == 1:
-            with self.countdown_lock:
-                if not getattr(game, "timeout_thread_started", False):
-                    threading.Thread(target=self.check_timeout, args=(game,)).start()
-                    setattr(game, "timeout_thread_started", True)
-
-        if game.can_start() and not game.is_active:
-            with self.countdown_lock:
-                if not getattr(game, "countdown_thread_started", False):
-                    threading.Thread(target=game.start_countdown).start()
-                    setattr(game, "countdown_thread_started", True)
-
-        return Response(
-            {"player": player.user.username, "card": player.bingo_card.numbers},
+from .matchmaking import find_lobby
+from . import game_loop
+
+
+class AsyncAPIView(View):
+    """
+    Async view authenticated like DRF's TokenAuthentication
+    (``Authorization: Token <key>``), so requests don't hop through the
+    sync-to-async thread adapter.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Token-authenticated API, like DRF's APIView
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        auth = request.headers.get('Authorization', '').split()
+        if len(auth) != 2 or auth[0].lower() != 'token':
+            return self.unauthorized("Authentication credentials were not provided.")
+        request.user = await sync_to_async(get_token_user)(auth[1])
+        if request.user is None:
+            return self.unauthorized("Invalid token.")
+        return await super().dispatch(request, *args, **kwargs)
+
+    @staticmethod
+    def get_data(request):
+        """
+        Request body as a dict, sent either as JSON or as a form. Raises
+        ``ValueError`` when the JSON is malformed or not an object.
+        """
+        if request.content_type == 'application/json':
+            data = json.loads(request.body or b'{}')
+            if not isinstance(data, dict):
+                raise ValueError("Expected a JSON object")
+            return data
+        return request.POST
+
+    @staticmethod
+    def unauthorized(detail):
+        response = JsonResponse({"detail": detail}, status=status.HTTP_401_UNAUTHORIZED)
+        response['WWW-Authenticate'] = 'Token'
+        return response
+
+
+class RegisterToGameView(AsyncAPIView):
+
+    async def post(self, request):
+        try:
+            data = self.get_data(request)
+        except ValueError:
+            return JsonResponse({"error": "Malformed JSON"}, status=status.HTTP_400_BAD_REQUEST)
+        mode = data.get('mode') or settings.BINGO_GAME_MODE
+        if not isinstance(mode, str) or mode not in settings.BINGO_GAME_MODES:
+            return JsonResponse({"error": f"Unknown game mode: {mode}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            count = int(data.get('cards', 1))
+        except (TypeError, ValueError):
+            count = 0
+        if not 1 <= count <= settings.BINGO_MAX_CARDS:
+            return JsonResponse(
+                {"error": f"cards must be between 1 and {settings.BINGO_MAX_CARDS}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        response, game, total_players = await sync_to_async(self.register)(request.user, mode, count)
+        if game is None:
+            return response
+
+        # The scheduler keeps at most one pending timer per game and kind,
+        # so concurrent registrations can't start a second countdown.
+        if total_players == 1:
+            game_loop.schedule_lobby_timeout(game.id, game.mode)
+
+        if total_players >= 2 and not game.is_active:
+            game_loop.schedule_countdown(game.id, game.mode)
+
+        return response
+
+    def register(self, user, mode=Game.DEFAULT_MODE, count=1):
+        """
+        Register the user in an open lobby of game ``mode`` with ``count``
+        cards; returns ``(response, game, total_players)``, with ``game``
+        ``None`` when registration failed.
+        """
+        # Popped outside the transaction so a rollback can't undo a pool refill
+        cards = card_pool.pop_many(count)
+
+        try:
+            with transaction.atomic():
+                game = find_lobby(user, mode)
+                if game is not None:
+                    player = Player.objects.create(user=user, game=game)
+                    # One UPDATE issues every card, however many were bought
+                    BingoCard.objects.filter(pk__in=[card.id for card in cards]).update(player=player, reserved_at=None)
+                    Game.objects.filter(pk=game.id).update(player_count=F('player_count') + 1)
+                    # Exact: find_lobby read the count under the row lock
+                    game.player_count += 1
+        except Exception:
+            card_pool.put_many(cards)
+            raise
+        if game is None:
+            card_pool.put_many(cards)
+            return JsonResponse({"error": "User is already registered for an active game"}, status=status.HTTP_400_BAD_REQUEST), None, 0
+
+        return JsonResponse(
+            {
+                "player": user.username,
+                "game": game.id,
+                "card": cards[0].numbers,
+                "cards": [card.numbers for card in cards],
+            },
             status=status.HTTP_201_CREATED
-        )
-
-
-    def check_timeout(self, game):
-        """Deletes the game if it doesn't reach 2 players within 60 seconds."""
-        import time
-
-        time.sleep(60)
-        if game.players.count() < 2 and not game.is_active:
-            # Notify the single player (if any)
-            player = Player.objects.filter(game=game).first()
-            if player:
-                print(f"Notifying user {player.user.username}: Game canceled due to insufficient players.")
-
-            game.delete()
+        ), game, game.player_count
 
 
-class ClaimWinView(APIView):
-    permission_classes = [IsAuthenticated]
-    claim_lock = threading.Lock()
+class ClaimWinView(AsyncAPIView):
 
-    def post(self, request):
+    async def post(self, request):
         user = request.user
-        with self.claim_lock:
-            game = Game.objects.filter(is_active=True).first()
-
-            if not game:
-                return Response({"error": "No active game"}, status=status.HTTP_400_BAD_REQUEST)
-
-            player = Player.objects.filter(user=user, game=game).first()
-            if not player:
-                return Response({"error": "Player not registered in the game"}, status=status.HTTP_400_BAD_REQUEST)
-
-            if game.validate_bingo_card(player):
-                with transaction.atomic():
-                    game.refresh_from_db()
-                    if game.winner is None:
-                        game.winner = user
-                        game.is_active = False
-                        game.save()
-                        asyncio.run(GameConsumer.send_to_all({
-                            'type': 'game.finish',
-                            'message': {'state': 'finished'}
-                        }))
-                        asyncio.run(GameConsumer.disconnect_all())
-                        return Response({"message": f"{user.username} wins the game!"}, status=status.HTTP_200_OK)
-                    else:
-                        return Response({"error": "Another player has already claimed the win"}, status=status.HTTP_400_BAD_REQUEST)
+        player = await Player.objects.filter(user=user, game__is_active=True).select_related('game').afirst()
+
+        if not player:
+            if not await Game.objects.filter(is_active=True).aexists():
+                return JsonResponse({"error": "No active game"}, status=status.HTTP_400_BAD_REQUEST)
+            return JsonResponse({"error": "Player not registered in the game"}, status=status.HTTP_400_BAD_REQUEST)
+        game = player.game
+
+        # The game loop marks every drawn ball on the cards it tracks, so
+        # the claim is a lookup; fall back to the stored cards otherwise.
+        is_winner = game_loop.tracked_winner(game.id, user.id)
+        if is_winner is None:
+            is_winner = await sync_to_async(game.validate_cards)(player)
+
+        if is_winner:
+            if await self.settle(game, user):
+                game_loop.stop_game(game.id)
+                await GameConsumer.send_to_game(game.id, {
+                    'type': 'game.finish',
+                    'message': {'state': 'finished'}
+                })
+                await GameConsumer.disconnect_game(game.id)
+                return JsonResponse({"message": f"{user.username} wins the game!"}, status=status.HTTP_200_OK)
             else:
-                player.delete()
-                asyncio.run(GameConsumer.send_to_all({
+                return JsonResponse({"error": "Another player has already claimed the win"}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            await player.adelete()
+            game_loop.remove_player(game.id, user.id)
+            await Game.objects.filter(pk=game.id).aupdate(player_count=F('player_count') - 1)
+            total_players = await Game.objects.filter(pk=game.id).values_list('player_count', flat=True).afirst() or 0
+            await GameConsumer.send_to_game(game.id, {
                 'type': 'game.total_players',
-                'message': {'total_players': game.players.count()}
-            }))
-                if game.players.count() == 0:
-                    game.is_active = False
-                    game.save()
-                    asyncio.run(GameConsumer.disconnect_all())
-                    game.delete()
-                return Response({"error": "Invalid claim, you are disqualified"}, status=status.HTTP_403_FORBIDDEN)
-
-class GetBingoCardView(APIView):
-    permission_classes = [IsAuthenticated]
+                'message': {'total_players': total_players}
+            })
+            if total_players == 0:
+                game_loop.stop_game(game.id)
+                await GameConsumer.disconnect_game(game.id)
+                await game.adelete()
+            return JsonResponse({"error": "Invalid claim, you are disqualified"}, status=status.HTTP_403_FORBIDDEN)
+
+    @staticmethod
+    async def settle(game, user):
+        """
+        Make ``user`` the winner with one conditional UPDATE, so exactly one
+        claim wins across any number of requests and processes.
+        """
+        state = game_loop.games.get(game.id)
+        if state is not None:
+            # Log the balls the winner saw before the loop stops
+            await sync_to_async(state.flush)(force=True)
+            drawn_balls = list(state.drawn_balls)
+        else:
+            # Drawn by another worker, which logs every ball
+            drawn_balls = await sync_to_async(game.get_drawn_balls)()
+        updated = await Game.objects.filter(
+            Exists(Player.objects.filter(game_id=game.id, user=user)), pk=game.id, is_active=True, winner=None
+        ).aupdate(winner=user, is_active=False, drawn_balls=drawn_balls)
+        return updated == 1
+
+
+class GetBingoCardView(AsyncAPIView):
+
+    async def get(self, request):
+        game_id = request.GET.get('game')
+        if game_id is not None and not game_id.isdigit():
+            return JsonResponse({"error": "Invalid game id"}, status=status.HTTP_400_BAD_REQUEST)
+
+        card = await get_player_card(request.user, game_id and int(game_id))
+        if card is None:
+            return JsonResponse({"error": "User is not part of an active game"}, status=status.HTTP_400_BAD_REQUEST)
+        etag, body = card
+
+        # Cards never change, so a client holding this one gets a 304
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class MetricsView(View):
+    """
+    Metrics of this process in the Prometheus text format, for scrapers
+    whose address is in BINGO_METRICS_IPS.
+    """
 
     def get(self, request):
-        user = request.user
-        player = Player.objects.filter(user=user).last()
-
-        if not player:
-            return Response({"error": "User is not part of an active game"}, status=status.HTTP_400_BAD_REQUEST)
-        card = {key: player.bingo_card.numbers[key] for key in ['B', 'I', 'N', 'G', 'O']}
-        return Response({"card": card}, status=status.HTTP_200_OK)
+        if request.META.get('REMOTE_ADDR') not in settings.BINGO_METRICS_IPS:
+            return HttpResponseForbidden()
+        return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 '''
 # uncomment this and the loggin in settings.py to enable query logging
@@ -0,0 +1,66 @@
+"""
+Wire formats of the game WebSocket, picked by the client with a subprotocol
+when it connects:
+
+- none: JSON objects, ``{"type": "game.ball", "message": {"ball": "I22", "seq": 3}}``
+- ``bingo.compact``: JSON arrays; a ball is ``["b",3,22]``, a catch-up
+  ``["c",first_seq,[balls...]]`` and other messages ``[short type, *values]``,
+  e.g. ``["p",4]`` for the player count
+- ``bingo.binary``: balls and catch-ups as binary frames of one byte per
+  value, ``[1, seq, ball]`` and ``[2, first_seq, balls...]``; other messages
+  as in ``bingo.compact``
+
+Messages are encoded once per format when broadcast, not once per socket.
+"""
+import json
+
+from .cards import BALL_LABELS
+
+JSON = 'json'
+COMPACT = 'bingo.compact'
+BINARY = 'bingo.binary'
+# In order of preference when a client offers several
+SUBPROTOCOLS = (BINARY, COMPACT)
+
+BALL_FRAME = 1
+CATCH_UP_FRAME = 2
+
+SHORT_TYPES = {
+    'game.ball': 'b',
+    'game.catch_up': 'c',
+    'game.total_players': 'p',
+    'game.finish': 'f',
+}
+
+
+def pick_format(offered):
+    """The wire format for the subprotocols a client offered."""
+    return next((protocol for protocol in SUBPROTOCOLS if protocol in offered), JSON)
+
+
+def compact_json(value):
+    return json.dumps(value, separators=(',', ':'))
+
+
+def encode_ball(seq, number):
+    return {
+        JSON: json.dumps({'type': 'game.ball', 'message': {'ball': BALL_LABELS[number], 'seq': seq}}),
+        COMPACT: f'["b",{seq},{number}]',
+        BINARY: bytes((BALL_FRAME, seq, number)),
+    }
+
+
+def encode_catch_up(first_seq, balls):
+    return {
+        JSON: json.dumps({'type': 'game.catch_up', 'message': {'balls': [
+            {'ball': BALL_LABELS[number], 'seq': seq} for seq, number in enumerate(balls, start=first_seq)
+        ]}}),
+        COMPACT: compact_json(['c', first_seq, list(balls)]),
+        BINARY: bytes((CATCH_UP_FRAME, first_seq, *balls)),
+    }
+
+
+def encode_message(message):
+    """Encode any other ``{"type", "message"}`` message."""
+    compact = compact_json([SHORT_TYPES.get(message['type'], message['type']), *message['message'].values()])
+    return {JSON: json.dumps(message), COMPACT: compact, BINARY: compact}